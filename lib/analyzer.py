@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import json
 import re
+import sys
 import time
+from functools import lru_cache
 from typing import Any, Dict, List, Literal, Optional, cast
 
 import requests
@@ -18,10 +20,122 @@ from lib.termux import termux_save_script_wrapper
 from lib.ui_core import AdaptiveStreamWriter, RICH_AVAILABLE, UserInterruptError, print_info, print_markdown
 
 
+# 裁剪/清洗循环里反复比较的角色串与字典键统一 intern：
+# CPython 对 interned 串先做指针相等短路，省掉逐字符比较
+_ROLE_SYSTEM = sys.intern("system")
+_ROLE_USER = sys.intern("user")
+_ROLE_ASSISTANT = sys.intern("assistant")
+_ROLE_TOOL = sys.intern("tool")
+_K_ROLE = sys.intern("role")
+_K_TOOL_CALLS = sys.intern("tool_calls")
+_K_TOOL_CALL_ID = sys.intern("tool_call_id")
+
+
 def as_msg(value: Dict[str, Any]) -> ChatCompletionMessageParam:
     return cast(ChatCompletionMessageParam, cast(object, value))
 
 
+# 内置危险命令模式合成单个交替正则：一次扫描覆盖全部规则，命中组名查表出原因。
+# 交替按原列表顺序排列，同起点命中时保持原有优先级；内部括号一律非捕获，
+# 保证 lastgroup 落在命名组上
+_DANGEROUS_RE = re.compile(
+    r"(?P<rm_rf>\brm\s+-rf?\b)"
+    r"|(?P<rm_r>\brm\s+-r\b)"
+    r"|(?P<mkfs>\bmkfs(?:\.|_|\s))"
+    r"|(?P<dd_if>\bdd\s+if=)"
+    r"|(?P<dd_of>\bdd\s+of=)"
+    r"|(?P<power>\bshutdown\b|\breboot\b)"
+    r"|(?P<mount>\bmount\b|\bumount\b)"
+    r"|(?P<chmod_root>\bchmod\b.*\s/(?:$|\s))"
+    r"|(?P<chown_root>\bchown\b.*\s/(?:$|\s))"
+    r"|(?P<pipe_sh>(?:curl|wget).*\|\s*(?:sh|bash)\b)"
+    r"|(?P<dev_block>>\s*/dev/block/)"
+)
+# termux 输出压缩时用来定位错误行的关键词；模块级编译，定位后用 rfind/find
+# 找行边界，不必把整段输出 split 成行列表
+_ERR_LINE_RE = re.compile(
+    r"traceback|exception|error|fatal|failed|permission denied|no such file|not found",
+    re.IGNORECASE,
+)
+
+# 同一类错误在多轮对话里反复出现；指引文案的正则分类按错误串缓存。
+# 依赖实例状态的部分（last_r2_file_path、session_ids）留在方法里，缓存只放纯函数部分
+@lru_cache(maxsize=64)
+def _recoverable_error_kinds(blob: str) -> tuple[str, ...]:
+    kinds: list[str] = []
+    if re.search(r"(no such file|enoent|not found|does not exist|file not found)", blob):
+        kinds.append("path")
+    if re.search(r"(permission denied|eacces|operation not permitted)", blob):
+        kinds.append("perm")
+    if "session" in blob and re.search(r"(invalid|not found|closed|expired)", blob):
+        kinds.append("session")
+    if re.search(r"(timeout|timed out|connection|temporar|gateway|502|503|504)", blob):
+        kinds.append("net")
+    if re.search(r"(invalid json|json|decode)", blob) and "http" in blob:
+        kinds.append("badjson")
+    return tuple(kinds)
+
+
+@lru_cache(maxsize=64)
+def _nonrecoverable_guidance_text(blob: str) -> str:
+    hints: list[str] = []
+    if re.search(r"(401|403|unauthorized|forbidden|api key|invalid key|auth)", blob):
+        hints.append("鉴权失败：检查 AI API Key / Base URL 是否正确；确认服务端/代理未拦截。")
+    if re.search(r"(429|rate limit|too many requests)", blob):
+        hints.append("触发限流：降低并发/等待一会再试；必要时更换模型或提高限额。")
+    if re.search(r"(500|internal server error)", blob) or re.search(r"(502|503|504|gateway)", blob):
+        hints.append("服务端/网关异常：先执行 health 确认桥接服务可用；再重试 tools/list 或 tool_calls。")
+    if re.search(r"(schema|参数校验失败|required|additionalproperties)", blob):
+        hints.append("参数/schema 问题：先运行 list/tools 确认 inputSchema，再按 required 字段补齐参数。")
+    if re.search(r"(permission denied|eacces|operation not permitted)", blob):
+        hints.append("权限问题：确认 Termux 存储权限（termux-setup-storage）或改用可读路径 /storage/emulated/0/...。")
+    if re.search(r"(no such file|enoent|not found|does not exist)", blob):
+        hints.append("路径不存在：先用 termux_command 执行 ls/stat/pwd 确认路径，再用正确路径重试。")
+
+    if not hints:
+        return ""
+    return "可能原因与建议：\n" + "\n".join(f"- {h}" for h in hints[:6])
+
+
+# termux 沙箱路径改写：/data/data/com.termux 后不是 /files 的都落到可写目录，
+# 可选吞掉已有的 /AI 段避免重复；单个预编译正则一遍替换，取代原先的两次 re.sub
+_TERMUX_REWRITE_RE = re.compile(r"/data/data/com\.termux(?!/files)(?:/AI\b)?")
+_TERMUX_REWRITE_TARGET = "/data/data/com.termux/files/home/AI"
+
+# 首个词就是裸命令的那几条规则可以 O(1) 判定：首 token 命中集合必然也会被
+# _DANGEROUS_RE 在位置 0 命中，原因文案与查表一致。rm/dd/chmod 等还要看
+# 后续参数，不进快路径。不用 shlex.split：纯 Python 词法器比一次 C 正则扫描还慢
+_DANGEROUS_FIRST_TOKENS = {
+    "shutdown": "shutdown/reboot",
+    "reboot": "shutdown/reboot",
+    "mount": "mount/umount",
+    "umount": "mount/umount",
+}
+
+_DANGEROUS_REASONS = {
+    "rm_rf": "rm -rf",
+    "rm_r": "rm -r",
+    "mkfs": "mkfs",
+    "dd_if": "dd if=",
+    "dd_of": "dd of=",
+    "power": "shutdown/reboot",
+    "mount": "mount/umount",
+    "chmod_root": "chmod on /",
+    "chown_root": "chown on /",
+    "pipe_sh": "curl|sh / wget|sh",
+    "dev_block": "write to /dev/block",
+}
+
+
+@lru_cache(maxsize=64)
+def _compile_danger_regex(pattern: str) -> Optional[re.Pattern[str]]:
+    # 配置里的 allow/deny 正则在会话期基本不变，按模式串缓存编译结果；非法正则照旧忽略
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        return None
+
+
 _DASHSCOPE_ENABLE_SEARCH_PREFIXES = (
     "qwen3-max", "qwen3-max-preview", "qwen-max", "qwen3.5-plus", "qwen-plus", "qwen-flash", "qwen-turbo",
     "qwq-plus", "deepseek-v3.2", "deepseek-v3.1", "deepseek-v3", "deepseek-r1-0528", "deepseek-r1",
@@ -44,6 +158,28 @@ _DASHSCOPE_ENABLE_SEARCH_EXCLUDE = (
 )
 
 
+# 模型名在会话期基本固定、每轮对话都要查：按归一化后的模型名记忆判定结果。
+# str.startswith(元组) 整段在 C 层短路，常见的「模型名即前缀打头」一次调用出结果；
+# 子串命中（如带日期后缀的变体）才退到逐项 in 扫描
+@lru_cache(maxsize=128)
+def _supports_search(m: str) -> bool:
+    for ex in _DASHSCOPE_ENABLE_SEARCH_EXCLUDE:
+        if ex in m:
+            return False
+    if m.startswith(_DASHSCOPE_ENABLE_SEARCH_PREFIXES):
+        return True
+    return any(p in m for p in _DASHSCOPE_ENABLE_SEARCH_PREFIXES)
+
+
+@lru_cache(maxsize=128)
+def _supports_thinking(m: str) -> bool:
+    if m.startswith(_DASHSCOPE_THINKING_ONLY_PREFIXES) or any(p in m for p in _DASHSCOPE_THINKING_ONLY_PREFIXES):
+        return False
+    if m.startswith(_DASHSCOPE_THINKING_MIXED_PREFIXES):
+        return True
+    return any(p in m for p in _DASHSCOPE_THINKING_MIXED_PREFIXES)
+
+
 def extract_session_ids(obj: Any) -> set[str]:
     found: set[str] = set()
     if isinstance(obj, dict):
@@ -192,9 +328,9 @@ class AIAnalyzer:
         for m in reversed(self.messages or []):
             if not isinstance(m, dict):
                 continue
-            if str(m.get("role", "") or "") != "assistant":
+            if str(m.get(_K_ROLE, "") or "") != _ROLE_ASSISTANT:
                 continue
-            tcs = m.get("tool_calls")
+            tcs = m.get(_K_TOOL_CALLS)
             if not isinstance(tcs, list):
                 continue
             for tc in tcs:
@@ -238,34 +374,15 @@ class AIAnalyzer:
 
     @staticmethod
     def _rewrite_termux_sandbox_paths(cmd: str) -> str:
-        s = str(cmd or "")
-        try:
-            s = re.sub(r"/data/data/com\.termux/AI\b", "/data/data/com.termux/files/home/AI", s)
-            return re.sub(r"/data/data/com\.termux(?!/files)", "/data/data/com.termux/files/home/AI", s)
-        except re.error:
-            return s
+        return _TERMUX_REWRITE_RE.sub(_TERMUX_REWRITE_TARGET, str(cmd or ""))
 
     @staticmethod
     def _model_supports_enable_search(model: str) -> bool:
-        m = str(model or "").strip().lower()
-        for ex in _DASHSCOPE_ENABLE_SEARCH_EXCLUDE:
-            if ex in m:
-                return False
-        for p in _DASHSCOPE_ENABLE_SEARCH_PREFIXES:
-            if m.startswith(p) or p in m:
-                return True
-        return False
+        return _supports_search(str(model or "").strip().lower())
 
     @staticmethod
     def _model_supports_enable_thinking(model: str) -> bool:
-        m = str(model or "").strip().lower()
-        for p in _DASHSCOPE_THINKING_ONLY_PREFIXES:
-            if m.startswith(p) or p in m:
-                return False
-        for p in _DASHSCOPE_THINKING_MIXED_PREFIXES:
-            if m.startswith(p) or p in m:
-                return True
-        return False
+        return _supports_thinking(str(model or "").strip().lower())
 
     def _maybe_enable_web_search(self, req: Dict[str, Any], tool_choice: str = "auto") -> None:
         if not self.enable_search:
@@ -513,14 +630,36 @@ class AIAnalyzer:
             if debug_enabled():
                 debug_log("trim_sanitize_error", {"error": f"{type(exc).__name__}: {str(exc)[:200]}"})
 
-        if len(self.messages) > self.max_context_messages:
-            system_msg = self.messages[0]
-            tail = self.messages[-(self.max_context_messages - 1):]
-
-            while tail and isinstance(tail[0], dict) and tail[0].get("role") == "tool":
-                tail = tail[1:]
+        # 快路径：条数没超时先用廉价的字符数上界估算（len 算术，不做 json
+        # 序列化）。上界都没超限就一定不会触发任何裁剪，直接返回；超了才进
+        # 下面 json.dumps 的精确统计。每次按当前列表现算，不维护增量计数，
+        # 测试直接替换 self.messages 也不会读到过期值
+        if len(self.messages) <= self.max_context_messages:
+            try:
+                est = 0
+                for m in self.messages:
+                    if not isinstance(m, dict):
+                        continue
+                    est += 64
+                    for k, v in m.items():
+                        est += 2 * len(k) + 6
+                        est += 2 * (len(v) if isinstance(v, str) else len(str(v)))
+                    if est > self.max_context_chars:
+                        break
+                if est <= self.max_context_chars:
+                    return
+            except (TypeError, ValueError):
+                pass
 
-            self.messages = [system_msg] + tail
+        if len(self.messages) > self.max_context_messages:
+            # 不换 deque 环形缓冲：maxlen 淘汰会把置顶的 system 挤掉，也无法保证
+            # assistant(tool_calls)/tool 成对淘汰。这里原地 del 一段前缀，
+            # 单次 memmove 完成淘汰，不再重建 [system] + tail 两个新列表
+            msgs = self.messages
+            cut = len(msgs) - (self.max_context_messages - 1)
+            while cut < len(msgs) and isinstance(msgs[cut], dict) and msgs[cut].get(_K_ROLE) == _ROLE_TOOL:
+                cut += 1
+            del msgs[1:cut]
             try:
                 self._sanitize_messages_for_tools()
             except (TypeError, ValueError, KeyError) as exc:
@@ -548,25 +687,22 @@ class AIAnalyzer:
                 return
 
             system = msgs[:1]
-            rest = msgs[1:]
+            # 开头的 sanitize 已保证消息全是 dict（非 dict 旧逻辑也会丢弃），
+            # 这里过滤一次后循环内不再逐元素 isinstance
+            rest = [m for m in msgs[1:] if isinstance(m, dict)]
 
             blocks: List[List[ChatCompletionMessageParam]] = []
             i = 0
             while i < len(rest):
                 m0 = rest[i]
-                if not isinstance(m0, dict):
-                    i += 1
-                    continue
-                role = str(m0.get("role", "") or "")
-                if role == "assistant" and isinstance(m0.get("tool_calls"), list) and m0.get("tool_calls"):
+                role = str(m0.get(_K_ROLE, "") or "")
+                if role == _ROLE_ASSISTANT and isinstance(m0.get(_K_TOOL_CALLS), list) and m0.get(_K_TOOL_CALLS):
                     block: List[ChatCompletionMessageParam] = [as_msg(m0)]
                     i += 1
                     while i < len(rest):
                         tm0 = rest[i]
-                        if not isinstance(tm0, dict):
-                            break
-                        t_role = str(tm0.get("role", "") or "")
-                        if t_role != "tool":
+                        t_role = str(tm0.get(_K_ROLE, "") or "")
+                        if t_role != _ROLE_TOOL:
                             break
                         block.append(as_msg(tm0))
                         i += 1
@@ -588,11 +724,12 @@ class AIAnalyzer:
             self.messages = system + kept
 
             if len(self.messages) >= 2 and isinstance(self.messages[1], dict) and self.messages[1].get(
-                    "role") == "tool":
-                tail2 = self.messages[1:]
-                while tail2 and isinstance(tail2[0], dict) and tail2[0].get("role") == "tool":
-                    tail2 = tail2[1:]
-                self.messages = self.messages[:1] + tail2
+                    _K_ROLE) == _ROLE_TOOL:
+                start2 = 1
+                while start2 < len(self.messages) and isinstance(self.messages[start2], dict) \
+                        and self.messages[start2].get(_K_ROLE) == _ROLE_TOOL:
+                    start2 += 1
+                del self.messages[1:start2]
             try:
                 self._sanitize_messages_for_tools()
             except (TypeError, ValueError, KeyError) as exc:
@@ -655,27 +792,42 @@ class AIAnalyzer:
         calls: List[Dict[str, Any]] = []
         # 匹配 ```...``` 代码块内的 JSON
         block_pattern = re.compile(r"```(?:json)?\s*\n?([\s\S]*?)```", re.IGNORECASE)
+        decoder = json.JSONDecoder()
         for m in block_pattern.finditer(content):
-            block = m.group(1).strip()
-            for line in block.split("\n"):
-                line = line.strip()
-                if not line or line.startswith("//"):
+            block = m.group(1)
+            # raw_decode 前向扫描：C 级 tokenizer 对每个对象只解析一遍，
+            # 相邻排列或跨多行的 JSON 对象都能取到，无需逐行试错重解析
+            i = 0
+            n = len(block)
+            while i < n:
+                brace = block.find("{", i)
+                if brace < 0:
+                    break
+                # 注释行（// 开头）里的示例 JSON 不能当成真调用执行，整行跳过
+                ls = block.rfind("\n", 0, brace) + 1
+                if block[ls:brace].lstrip().startswith("//"):
+                    nl = block.find("\n", brace)
+                    if nl < 0:
+                        break
+                    i = nl + 1
                     continue
                 try:
-                    obj = json.loads(line)
-                    if not isinstance(obj, dict):
-                        continue
-                    name = str(obj.get("name") or obj.get("tool") or "").strip()
-                    args = obj.get("arguments") or obj.get("args") or obj.get("params") or {}
-                    if not name or not isinstance(args, dict):
-                        continue
-                    calls.append({
-                        "id": f"txt_{len(calls)}",
-                        "type": "function",
-                        "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
-                    })
+                    obj, end = decoder.raw_decode(block, brace)
                 except (json.JSONDecodeError, TypeError, ValueError):
+                    i = brace + 1
                     continue
+                i = end
+                if not isinstance(obj, dict):
+                    continue
+                name = str(obj.get("name") or obj.get("tool") or "").strip()
+                args = obj.get("arguments") or obj.get("args") or obj.get("params") or {}
+                if not name or not isinstance(args, dict):
+                    continue
+                calls.append({
+                    "id": f"txt_{len(calls)}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)},
+                })
         if calls:
             return calls
         # 尝试整行匹配
@@ -817,20 +969,20 @@ class AIAnalyzer:
         i = 0
         while i < len(src):
             msg = src[i]
-            role = str(msg.get("role", "") or "")
-            if role != "assistant":
-                if role != "tool":
+            role = str(msg.get(_K_ROLE, "") or "")
+            if role != _ROLE_ASSISTANT:
+                if role != _ROLE_TOOL:
                     cleaned.append(as_msg(msg))
                 i += 1
                 continue
-            tcs_raw = msg.get("tool_calls")
+            tcs_raw = msg.get(_K_TOOL_CALLS)
             if not (isinstance(tcs_raw, list) and tcs_raw):
                 cleaned.append(as_msg(msg))
                 i += 1
                 continue
             j = i + 1
             tool_msgs: List[Dict[str, Any]] = []
-            while j < len(src) and str(src[j].get("role", "") or "") == "tool":
+            while j < len(src) and str(src[j].get(_K_ROLE, "") or "") == _ROLE_TOOL:
                 tool_msgs.append(src[j])
                 j += 1
             parts: List[str] = []
@@ -865,20 +1017,21 @@ class AIAnalyzer:
         i = 0
         while i < len(src):
             msg = src[i]
-            role = str(msg.get("role", "") or "")
-            if role != "assistant":
-                if role != "tool":
+            role = str(msg.get(_K_ROLE, "") or "")
+            if role != _ROLE_ASSISTANT:
+                if role != _ROLE_TOOL:
                     cleaned.append(as_msg(msg))
                 i += 1
                 continue
 
-            tcs_raw = msg.get("tool_calls")
+            tcs_raw = msg.get(_K_TOOL_CALLS)
             if not (isinstance(tcs_raw, list) and tcs_raw):
                 cleaned.append(as_msg(msg))
                 i += 1
                 continue
 
-            expected_ids: List[str] = []
+            # 期望 id 存集合：后面逐条 tool 消息的归属判断是 O(1) 哈希探测
+            expected_ids: set[str] = set()
             fixed_tcs: List[Dict[str, Any]] = []
             for idx, tc in enumerate(tcs_raw):
                 if not isinstance(tc, dict):
@@ -891,7 +1044,7 @@ class AIAnalyzer:
                     tc["id"] = tid
                 if not tid or not name:
                     continue
-                expected_ids.append(tid)
+                expected_ids.add(tid)
                 fixed_tcs.append(tc)
 
             j = i + 1
@@ -899,10 +1052,10 @@ class AIAnalyzer:
             responded: set[str] = set()
             while j < len(src):
                 tm = src[j]
-                t_role = str(tm.get("role", "") or "")
-                if t_role != "tool":
+                t_role = str(tm.get(_K_ROLE, "") or "")
+                if t_role != _ROLE_TOOL:
                     break
-                tci = str(tm.get("tool_call_id", "") or "").strip()
+                tci = str(tm.get(_K_TOOL_CALL_ID, "") or "").strip()
                 if tci and (tci in expected_ids):
                     tool_msgs.append(tm)
                     responded.add(tci)
@@ -949,12 +1102,25 @@ class AIAnalyzer:
         t = (text or "").replace("\r\n", "\n").replace("\r", "\n")
         if not t:
             return t
+        if len(t) > max_chars * 8:
+            # 兆级输出没必要整串按行切：行数用 count 统计，头尾各取一个
+            # 有界窗口（每行预算 512 字符）再切行，拷贝量从 O(N) 降为 O(头+尾)
+            total = t.count("\n") + 1
+            if total > (head_lines + tail_lines + 10):
+                head = t[:head_lines * 512].split("\n")[:head_lines]
+                tail = t[-tail_lines * 512:].split("\n")[-tail_lines:]
+                omitted = max(0, total - len(head) - len(tail))
+                out = "\n".join((*head, f"...(中间省略 {omitted} 行)...", *tail))
+                if len(out) <= max_chars:
+                    return out
+                t = out
         lines = t.split("\n")
         if len(lines) > (head_lines + tail_lines + 10):
             head = lines[:head_lines]
             tail = lines[-tail_lines:]
             omitted = max(0, len(lines) - len(head) - len(tail))
-            out = "\n".join(head) + f"\n...(中间省略 {omitted} 行)...\n" + "\n".join(tail)
+            # 头+省略行+尾一次 join 出结果，省掉两段中间串的拷贝
+            out = "\n".join((*head, f"...(中间省略 {omitted} 行)...", *tail))
             if len(out) <= max_chars:
                 return out
             t = out
@@ -974,25 +1140,41 @@ class AIAnalyzer:
         out: Dict[str, Any] = dict(result)
 
         if tool_name == "termux_command":
-            key_re = re.compile(r"(traceback|exception|error|fatal|failed|permission denied|no such file|not found)",
-                                re.IGNORECASE)
             for k in ("stdout", "stderr", "output", "text", "result"):
                 v = out.get(k)
                 if isinstance(v, str) and len(v) > 2000:
-                    lines = v.replace("\r\n", "\n").replace("\r", "\n").split("\n")
-                    hit_idx: list[int] = []
-                    for i, line in enumerate(lines):
-                        if key_re.search(line or ""):
-                            hit_idx.append(i)
-                            if len(hit_idx) >= 20:
+                    # 正则直接扫全文定位命中，再用 rfind/find 扩出前后各 3 行的
+                    # 字符区间，省掉整段 split 出来的行列表
+                    t = v.replace("\r\n", "\n").replace("\r", "\n")
+                    spans: list[list[int]] = []
+                    hit_line_starts: set[int] = set()
+                    for m in _ERR_LINE_RE.finditer(t):
+                        ls = t.rfind("\n", 0, m.start()) + 1
+                        if ls in hit_line_starts:
+                            continue
+                        hit_line_starts.add(ls)
+                        s = ls
+                        for _ in range(3):
+                            if s <= 0:
+                                break
+                            s = t.rfind("\n", 0, s - 1) + 1
+                        e = t.find("\n", m.start())
+                        if e < 0:
+                            e = len(t)
+                        for _ in range(3):
+                            if e >= len(t):
                                 break
-                    if hit_idx:
-                        keep: set[int] = set()
-                        for i in hit_idx:
-                            for j in range(max(0, i - 3), min(len(lines), i + 4)):
-                                keep.add(j)
-                        picked = [lines[i] for i in sorted(keep)]
-                        excerpt = "\n".join(picked).strip()
+                            nxt = t.find("\n", e + 1)
+                            e = len(t) if nxt < 0 else nxt
+                        # 命中按位置递增，区间重叠时就地合并
+                        if spans and s <= spans[-1][1] + 1:
+                            spans[-1][1] = max(spans[-1][1], e)
+                        else:
+                            spans.append([s, e])
+                        if len(hit_line_starts) >= 20:
+                            break
+                    if spans:
+                        excerpt = "\n".join(t[s:e] for s, e in spans).strip()
                         out[k] = self._compact_text_output(excerpt, head_lines=80, tail_lines=80, max_chars=12_000)
                     else:
                         out[k] = self._compact_text_output(v)
@@ -1016,45 +1198,46 @@ class AIAnalyzer:
         if not c:
             return False, ""
         low = c.lower()
-
-        patterns: list[tuple[str, str]] = [
-            (r"\brm\s+-rf?\b", "rm -rf"),
-            (r"\brm\s+-r\b", "rm -r"),
-            (r"\bmkfs(\.|_|\s)", "mkfs"),
-            (r"\bdd\s+if=", "dd if="),
-            (r"\bdd\s+of=", "dd of="),
-            (r"\bshutdown\b|\breboot\b", "shutdown/reboot"),
-            (r"\bmount\b|\bumount\b", "mount/umount"),
-            (r"\bchmod\b.*\s/($|\s)", "chmod on /"),
-            (r"\bchown\b.*\s/($|\s)", "chown on /"),
-            (r"(curl|wget).*\|\s*(sh|bash)\b", "curl|sh / wget|sh"),
-            (r">\s*/dev/block/", "write to /dev/block"),
-        ]
-        for pat, reason in patterns:
-            if re.search(pat, low):
-                return True, reason
+        first = low.split(None, 1)[0]
+        reason = _DANGEROUS_FIRST_TOKENS.get(first)
+        if reason is not None:
+            return True, reason
+        m = _DANGEROUS_RE.search(low)
+        if m is not None and m.lastgroup:
+            return True, _DANGEROUS_REASONS.get(m.lastgroup, m.lastgroup)
         return False, ""
 
-    def _dangerous_action_for_termux_command(self, cmd: str) -> tuple[bool, str]:
-        is_danger, reason = self._is_dangerous_termux_command(cmd)
-        if self.dangerous_extra_deny_regex:
-            try:
-                if re.search(self.dangerous_extra_deny_regex, cmd or "", flags=re.IGNORECASE):
-                    return True, reason or "extra_deny_regex"
-            except re.error:
-                pass
-        if self.dangerous_allow_regex:
-            try:
-                if re.search(self.dangerous_allow_regex, cmd or "", flags=re.IGNORECASE):
-                    return False, ""
-            except re.error:
-                pass
+    @staticmethod
+    def is_dangerous_termux_command_with(cmd: str, allow_regex: str = "", extra_deny_regex: str = "") -> tuple[
+            bool, str]:
+        return AIAnalyzer.dangerous_action_for_termux_command_compiled(
+            cmd,
+            _compile_danger_regex(allow_regex) if allow_regex else None,
+            _compile_danger_regex(extra_deny_regex) if extra_deny_regex else None,
+        )
+
+    @staticmethod
+    def dangerous_action_for_termux_command_compiled(
+            cmd: str,
+            allow_re: Optional[re.Pattern[str]],
+            extra_deny_re: Optional[re.Pattern[str]],
+    ) -> tuple[bool, str]:
+        is_danger, reason = AIAnalyzer._is_dangerous_termux_command(cmd)
+        if extra_deny_re is not None and extra_deny_re.search(cmd or ""):
+            return True, reason or "extra_deny_regex"
+        if allow_re is not None and allow_re.search(cmd or ""):
+            return False, ""
         return is_danger, reason
 
     @staticmethod
     def is_dangerous_termux_command(cmd: str) -> tuple[bool, str]:
         return AIAnalyzer._is_dangerous_termux_command(cmd)
 
+    def _dangerous_action_for_termux_command(self, cmd: str) -> tuple[bool, str]:
+        return AIAnalyzer.is_dangerous_termux_command_with(
+            cmd, self.dangerous_allow_regex, self.dangerous_extra_deny_regex
+        )
+
     def dangerous_action_for_termux_command(self, cmd: str) -> tuple[bool, str]:
         return self._dangerous_action_for_termux_command(cmd)
 
@@ -1064,12 +1247,13 @@ class AIAnalyzer:
             return ""
         hints: List[str] = []
 
-        if re.search(r"(no such file|enoent|not found|does not exist|file not found)", blob):
+        kinds = _recoverable_error_kinds(blob)
+        if "path" in kinds:
             hints.append("路径/文件不存在：先用 termux_command 执行 pwd + ls/stat 校验真实路径，再重试相关 r2_* 工具。")
-        if re.search(r"(permission denied|eacces|operation not permitted)", blob):
+        if "perm" in kinds:
             hints.append(
                 "权限问题：优先改用可读目录(/storage/emulated/0/... 或 $HOME)，必要时提示用户 termux-setup-storage/chmod。")
-        if "session" in blob and re.search(r"(invalid|not found|closed|expired)", blob):
+        if "session" in kinds:
             fp = str(getattr(self, "last_r2_file_path", "") or "").strip()
             if fp:
                 hints.append(
@@ -1079,9 +1263,9 @@ class AIAnalyzer:
             else:
                 hints.append(
                     "session 无效：先重新 r2_open_file 获取新 session_id，再继续 r2_run_command/r2_analyze_target。")
-        if re.search(r"(timeout|timed out|connection|temporar|gateway|502|503|504)", blob):
+        if "net" in kinds:
             hints.append("网络/网关抖动：优先重试同一 tool_calls；必要时先 health，再继续 tools/call。")
-        if re.search(r"(invalid json|json|decode)", blob) and "http" in blob:
+        if "badjson" in kinds:
             hints.append("服务端返回非 JSON：检查 bridge/服务端日志，或先 health 确认服务端状态后再重试。")
 
         if self.session_ids:
@@ -1097,24 +1281,7 @@ class AIAnalyzer:
         blob = "\n".join(str(x) for x in (errors or [])).lower()
         if not blob.strip():
             return ""
-        hints: List[str] = []
-
-        if re.search(r"(401|403|unauthorized|forbidden|api key|invalid key|auth)", blob):
-            hints.append("鉴权失败：检查 AI API Key / Base URL 是否正确；确认服务端/代理未拦截。")
-        if re.search(r"(429|rate limit|too many requests)", blob):
-            hints.append("触发限流：降低并发/等待一会再试；必要时更换模型或提高限额。")
-        if re.search(r"(500|internal server error)", blob) or re.search(r"(502|503|504|gateway)", blob):
-            hints.append("服务端/网关异常：先执行 health 确认桥接服务可用；再重试 tools/list 或 tool_calls。")
-        if re.search(r"(schema|参数校验失败|required|additionalproperties)", blob):
-            hints.append("参数/schema 问题：先运行 list/tools 确认 inputSchema，再按 required 字段补齐参数。")
-        if re.search(r"(permission denied|eacces|operation not permitted)", blob):
-            hints.append("权限问题：确认 Termux 存储权限（termux-setup-storage）或改用可读路径 /storage/emulated/0/...。")
-        if re.search(r"(no such file|enoent|not found|does not exist)", blob):
-            hints.append("路径不存在：先用 termux_command 执行 ls/stat/pwd 确认路径，再用正确路径重试。")
-
-        if not hints:
-            return ""
-        return "可能原因与建议：\n" + "\n".join(f"- {h}" for h in hints[:6])
+        return _nonrecoverable_guidance_text(blob)
 
     def _build_recoverable_prompt(
             self,
@@ -1127,26 +1294,38 @@ class AIAnalyzer:
         guidance = self._recoverable_guidance(recoverable_errors)
         err_lines = "\n".join(f"- {e}" for e in (recoverable_errors or [])[:8])
 
+        # 片段攒在列表里最后一次 join，避免 + 级联拼接的中间字符串
+        parts: List[str] = []
         if partial_success:
-            return (
-                    "你已经成功执行了部分工具调用；请不要重复调用已成功的工具（除非你能明确说明必须重复的理由）。\n"
-                    f"本轮已成功工具（不要重复）：{ok_list}\n"
-                    "以下为本轮可恢复失败（请仅针对这些失败项修复并重发 tool_calls）：\n"
-                    + err_lines
-                    + (("\n\n" + guidance) if guidance else "")
-                    + "\n\n"
-                      "要求：直接输出标准 tool_calls；不要输出 DSML；不要输出口头计划；不要输出最终 Markdown。\n"
+            parts.append(
+                "你已经成功执行了部分工具调用；请不要重复调用已成功的工具（除非你能明确说明必须重复的理由）。\n"
+                f"本轮已成功工具（不要重复）：{ok_list}\n"
+                "以下为本轮可恢复失败（请仅针对这些失败项修复并重发 tool_calls）：\n"
+            )
+            parts.append(err_lines)
+            if guidance:
+                parts.append("\n\n")
+                parts.append(guidance)
+            parts.append(
+                "\n\n"
+                "要求：直接输出标准 tool_calls；不要输出 DSML；不要输出口头计划；不要输出最终 Markdown。\n"
             )
+            return "".join(parts)
 
-        return (
-                "你刚才的工具调用返回了“可恢复(recoverable=true)”错误，说明还没完成任务。\n"
-                "请不要输出最终 Markdown/结论；请直接修正并重发标准 tool_calls（只输出 tool_calls）。\n"
-                "本轮可恢复错误摘要：\n"
-                + "\n".join(f"- {e}" for e in (recoverable_errors or [])[:6])
-                + (("\n\n" + guidance) if guidance else "")
-                + "\n\n"
-                  "硬要求：如果你需要 session_id，必须先从上一轮工具输出中提取或重新 r2_open_file；禁止凭空猜测。\n"
+        parts.append(
+            "你刚才的工具调用返回了“可恢复(recoverable=true)”错误，说明还没完成任务。\n"
+            "请不要输出最终 Markdown/结论；请直接修正并重发标准 tool_calls（只输出 tool_calls）。\n"
+            "本轮可恢复错误摘要：\n"
+        )
+        parts.append("\n".join(f"- {e}" for e in (recoverable_errors or [])[:6]))
+        if guidance:
+            parts.append("\n\n")
+            parts.append(guidance)
+        parts.append(
+            "\n\n"
+            "硬要求：如果你需要 session_id，必须先从上一轮工具输出中提取或重新 r2_open_file；禁止凭空猜测。\n"
         )
+        return "".join(parts)
 
     def _stream_assistant_turn(self, tool_choice: str = "auto") -> Dict[str, Any]:
         self._trim_messages()
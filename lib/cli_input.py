@@ -73,7 +73,7 @@ def _config_subcommands() -> List[str]:
 
 
 def _ai_flags() -> List[str]:
-    return ["--loose", "--plain", "--strict", "--tools"]
+    return ["--loose", "--plain", "--strict", "--tools", "--yes-save", "--no-save", "--continue", "--once"]
 
 
 def _tool_names(ctx: CommandContext) -> List[str]:
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import heapq
 import json
+import os
 import re
+from functools import lru_cache
 
 import requests
 
@@ -19,6 +22,31 @@ from lib.schema import validate_args
 from lib.termux import termux_save_script_wrapper
 from lib.ui_core import UserInterruptError, print_info, print_markdown
 
+_DEX_RE = re.compile(r"classes\d*\.dex")
+
+# 工作流收尾提示词的固定部分：模块级常量，重复跑工作流时不反复拼接
+_APK_PROMPT_TMPL = (
+    "基于已收集的证据，继续深入分析 APK：{path}。\n"
+    "如果已经提取到 dex/拿到 session_id，请从当前 session 继续；"
+    "否则请自行用 tool_calls 重新取证。\n"
+    "目标：定位校验/反调试/加固逻辑，输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
+)
+_DEX_PROMPT_TMPL = (
+    "继续深入分析 DEX：{path}\n"
+    "目标：定位关键类/关键字符串/验证入口；输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
+)
+_SO_PROMPT_TMPL = (
+    "继续深入分析 native so：{path}\n"
+    "目标：优先分析导入导出/JNI/反调试/加密校验迹象；输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
+)
+
+
+@lru_cache(maxsize=256)
+def _cached_danger(cmd: str, allow_re: str, extra_deny: str) -> tuple[bool, str]:
+    # 开发循环里同一条命令常被反复执行，按 (命令, 允许/额外拒绝正则) 缓存判定结果
+    from lib.analyzer import AIAnalyzer
+    return AIAnalyzer.is_dangerous_termux_command_with(cmd, allow_re, extra_deny)
+
 
 def _is_no_retry_error(exc: BaseException) -> bool:
     s = str(exc).lower()
@@ -69,7 +97,7 @@ def _render_tools_markdown(tool_specs: object) -> str:
     for gname in sorted(groups.keys()):
         lines.append(f"### {gname}")
         for tool_name in sorted(groups[gname]):
-            spec = tool_specs.get(tool_name) if isinstance(tool_specs, dict) else None
+            spec = tool_specs.get(tool_name)
             required: list[str] = []
             optional: list[str] = []
             if isinstance(spec, dict):
@@ -80,10 +108,8 @@ def _render_tools_markdown(tool_specs: object) -> str:
                 if isinstance(props, dict):
                     optional = [str(x) for x in props.keys() if isinstance(x, str) and x not in required]
             req_s = ", ".join(required) if required else "-"
-            opt_s = ", ".join(sorted(optional)[:24]) if optional else "-"
-            lines.append(f"- `{tool_name}`")
-            lines.append(f"  - required: {req_s}")
-            lines.append(f"  - optional: {opt_s}")
+            opt_s = ", ".join(heapq.nsmallest(24, optional)) if optional else "-"
+            lines.append(f"- `{tool_name}`\n  - required: {req_s}\n  - optional: {opt_s}")
         lines.append("")
     lines.append("说明：该列表由服务端 schema 决定；更详细的行为请以服务端实现为准。")
     return "\n".join(lines).strip() + "\n"
@@ -170,7 +196,7 @@ def handle_call(raw: str, ctx: CommandContext) -> bool:
     if not raw.startswith("call "):
         return False
     try:
-        rest = raw[len("call "):].strip()
+        rest = raw.removeprefix("call ").strip()
         if not rest:
             print("格式错误，请使用: call <工具名> [JSON参数]")
             return True
@@ -186,7 +212,7 @@ def handle_call(raw: str, ctx: CommandContext) -> bool:
         json_part = tail
         if tail.startswith("--force"):
             force = True
-            json_part = tail[len("--force"):].strip()
+            json_part = tail.removeprefix("--force").strip()
 
         if json_part and json_part.strip():
             args = json.loads(json_part)
@@ -204,33 +230,33 @@ def handle_call(raw: str, ctx: CommandContext) -> bool:
                     ctx.analyzer.dangerous_policy = policy
                     ctx.analyzer.dangerous_allow_regex = allow_re
                     ctx.analyzer.dangerous_extra_deny_regex = extra_deny
-                    is_danger, reason = ctx.analyzer.dangerous_action_for_termux_command(cmd)
-                else:
-                    from lib.analyzer import AIAnalyzer
-                    is_danger, reason = AIAnalyzer.is_dangerous_termux_command(cmd)
+                is_danger, reason = _cached_danger(cmd, allow_re, extra_deny)
                 if is_danger:
                     print_info(f"[提示] 检测到危险命令（{reason}）: {cmd}")
-                    if policy == "deny":
+                    env_danger = os.getenv("R2AI_DANGEROUS", "").strip().lower()
+                    if policy == "deny" or env_danger == "deny":
                         print_info("[提示] 当前策略为 deny，已阻止。可用: call termux_command --force {...} 强制执行。")
                         return True
-                    yn = input("是否继续执行该命令？(y/N): ").strip().lower()
+                    yn = "y" if env_danger == "allow" else input("是否继续执行该命令？(y/N): ").strip().lower()
                     if yn != "y":
                         print_info("[提示] 已取消执行。可用: call termux_command --force {...} 强制执行。")
                         return True
 
-        spec = ctx.schema_module.ACTIVE_TOOL_SPECS.get(tool_name) if isinstance(ctx.schema_module.ACTIVE_TOOL_SPECS,
-                                                                                dict) else None
+        specs = ctx.schema_module.ACTIVE_TOOL_SPECS
+        if not isinstance(specs, dict):
+            specs = {}
+        spec = specs.get(tool_name)
+        required = spec.get("required") if isinstance(spec, dict) else None
         if (
-                isinstance(spec, dict)
-                and isinstance(spec.get("required"), list)
-                and ("session_id" in spec.get("required"))
+                isinstance(required, list)
+                and ("session_id" in required)
                 and ("session_id" not in args)
                 and ctx.active_session_id
         ):
             args["session_id"] = ctx.active_session_id
 
         if tool_name == "termux_save_script":
-            err = validate_args(tool_name, args, ctx.schema_module.ACTIVE_TOOL_SPECS)
+            err = validate_args(tool_name, args, specs)
             if err:
                 raise ValueError(err)
             resp = termux_save_script_wrapper(
@@ -240,7 +266,7 @@ def handle_call(raw: str, ctx: CommandContext) -> bool:
             )
             print(json.dumps(resp, ensure_ascii=False, indent=2))
         else:
-            err = validate_args(tool_name, args, ctx.schema_module.ACTIVE_TOOL_SPECS)
+            err = validate_args(tool_name, args, specs)
             if err:
                 raise ValueError(err)
             resp = ctx.bridge.call_tool(tool_name, args)
@@ -307,20 +333,28 @@ def _run_ai_question(ctx: CommandContext, question: str, *, mode: str = "loose")
     return result
 
 
-def ai_message(ctx, question: str, *, mode: str = "loose"):
+def ai_message(ctx, question: str, *, mode: str = "loose", auto_save: str = "", auto_continue: str = ""):
+    env_kb = os.getenv("R2AI_AUTO_KB", "").strip().lower()
+    save_pref = auto_save or (env_kb if env_kb in {"y", "n"} else "")
+    cont_pref = auto_continue
     result = _run_ai_question(ctx, question, mode=mode)
     while True:
         if result == "已中断当前 AI 思考。":
             print_info("[提示] 已中断当前 AI 思考。")
             break
-        save_choice = input("是否将本次最终结果写入知识库？(y/N): ").strip().lower()
+        if save_pref:
+            save_choice = save_pref
+        else:
+            save_choice = input("是否将本次最终结果写入知识库？(y/N): ").strip().lower()
         if save_choice == "y":
             dsml_found = contains_dsml_markup(result)
             if str(result or "").strip() in {"本轮分析结束。", "(模型未返回文本)"}:
                 print_info("[知识库] 已跳过写入（原因：结果为占位文本，和最终输出不一致风险高）。")
                 dsml_found = True
             force = "n"
-            if dsml_found:
+            if dsml_found and save_pref:
+                print_info("[知识库] 已跳过写入（原因：检测到 DSML 内容，非交互模式不强制写入）。")
+            elif dsml_found:
                 force = input(
                     "检测到内容包含 DSML/协议片段，默认不写入知识库。是否仍强制写入？(y/N): "
                 ).strip().lower()
@@ -328,13 +362,18 @@ def ai_message(ctx, question: str, *, mode: str = "loose"):
                     print_info("[知识库] 已跳过写入（原因：检测到 DSML 内容）。")
                 else:
                     print_info("[知识库] 警告：仍将写入包含 DSML 的内容（不推荐）。")
-            item = build_kb_item(question, result)
             if (not dsml_found) or (force == "y"):
+                item = build_kb_item(question, result)
                 append_kb_item(KB_SAVE_PATH, item)
                 ctx.kb_items.append(item)
                 print_info(f"[知识库] 已写入: {KB_SAVE_PATH}")
 
-        cont_choice = input("是否继续上一轮 AI 分析？(y/N): ").strip().lower()
+        if cont_pref:
+            cont_choice = cont_pref
+            # --continue 只自动续一轮，避免无人值守时无限循环
+            cont_pref = "n" if cont_pref == "y" else cont_pref
+        else:
+            cont_choice = input("是否继续上一轮 AI 分析？(y/N): ").strip().lower()
         if cont_choice == "y":
             result = _run_ai_question(
                 ctx,
@@ -351,7 +390,7 @@ def handle_ai(raw: str, ctx: CommandContext) -> bool:
         pass
     else:
         return False
-    rest = raw[2:].strip()
+    rest = raw.removeprefix("ai").strip()
     if not rest:
         print("用法: ai [--strict|--loose|--plain|--tools] <问题>")
         return True
@@ -364,13 +403,34 @@ def handle_ai(raw: str, ctx: CommandContext) -> bool:
         return True
     if rest.startswith("--strict "):
         mode = "strict"
-        question = rest[len("--strict "):].strip()
+        question = rest.removeprefix("--strict ").strip()
     elif rest.startswith("--loose "):
         mode = "loose"
-        question = rest[len("--loose "):].strip()
+        question = rest.removeprefix("--loose ").strip()
     elif rest.startswith("--plain "):
         mode = "loose"
-        question = rest[len("--plain "):].strip()
+        question = rest.removeprefix("--plain ").strip()
+
+    auto_save = ""
+    auto_continue = ""
+    while True:
+        if question.startswith("--yes-save "):
+            auto_save = "y"
+            question = question.removeprefix("--yes-save ").strip()
+            continue
+        if question.startswith("--no-save "):
+            auto_save = "n"
+            question = question.removeprefix("--no-save ").strip()
+            continue
+        if question.startswith("--continue "):
+            auto_continue = "y"
+            question = question.removeprefix("--continue ").strip()
+            continue
+        if question.startswith("--once "):
+            auto_continue = "n"
+            question = question.removeprefix("--once ").strip()
+            continue
+        break
 
     if not question:
         print("请输入问题，例如: ai --strict 先打开 /sdcard/a.so 并列出函数")
@@ -388,7 +448,7 @@ def handle_ai(raw: str, ctx: CommandContext) -> bool:
     if ":\\" in question:
         print("[提示] 你输入的是 Windows 路径。R2 服务通常运行在 Android/Termux 端，请改用 /storage/... 绝对路径。")
     try:
-        ai_message(ctx, question, mode=mode)
+        ai_message(ctx, question, mode=mode, auto_save=auto_save, auto_continue=auto_continue)
     except KeyboardInterrupt:
         print_info("[提示] 已中断当前 AI 分析。")
     except (requests.RequestException, JsonRpcError, ValueError, TypeError, OSError, RuntimeError) as exc:
@@ -423,15 +483,19 @@ def handle_workflows(raw: str, ctx: CommandContext) -> bool:
             raise ValueError(f"{name}: {err}")
         return ctx.bridge.call_tool(name, args)
 
+    def _run_r2_batch(session_id: str, commands: list[str]) -> dict:
+        # r2 支持 `;` 分隔的命令串：N 次 JSON-RPC 往返合并为 1 次
+        return _call_tool("r2_run_command", {"session_id": session_id, "command": ";".join(commands)})
+
     def _parse_flag_and_path(cmd: str, prefix: str) -> tuple[str, str]:
-        rest = cmd[len(prefix):].strip()
+        rest = cmd.removeprefix(prefix).strip()
         parsed_mode = "deep"
         if rest.startswith("--fast "):
             parsed_mode = "fast"
-            rest = rest[len("--fast "):].strip()
+            rest = rest.removeprefix("--fast ").strip()
         elif rest.startswith("--deep "):
             parsed_mode = "deep"
-            rest = rest[len("--deep "):].strip()
+            rest = rest.removeprefix("--deep ").strip()
         return parsed_mode, rest
 
     if raw.startswith("apk_analyze "):
@@ -458,12 +522,10 @@ def handle_workflows(raw: str, ctx: CommandContext) -> bool:
             if isinstance(out, dict):
                 stdout = str(out.get("stdout") or out.get("output") or "")
             dex_name = "classes.dex"
-            try:
-                dex_match = re.search(r"(classes\\d*\\.dex)", stdout)
-            except re.error:
-                dex_match = None
-            if dex_match:
-                dex_name = dex_match.group(1)
+            if "classes" in stdout:
+                dex_match = _DEX_RE.search(stdout)
+                if dex_match:
+                    dex_name = dex_match.group(0)
             dex_path = f"{tmp_dir}/{dex_name}"
 
             print_info(f"[apk_analyze] 4) r2 打开 DEX: {dex_path}")
@@ -476,20 +538,14 @@ def handle_workflows(raw: str, ctx: CommandContext) -> bool:
             if ctx.active_session_id:
                 print_info("[apk_analyze] 5) basic analyze + strings snapshot")
                 _call_tool("r2_analyze_target", {"session_id": ctx.active_session_id, "strategy": "basic"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "i"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "iz"})
+                cmds = ["i", "iz"]
                 if analysis_mode == "deep":
-                    _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "ic"})
+                    cmds.append("ic")
+                _run_r2_batch(ctx.active_session_id, cmds)
         except (requests.RequestException, JsonRpcError, ValueError, TypeError, OSError, RuntimeError, KeyError) as exc:
             print_info(f"[apk_analyze] 固定取证失败：{exc}（将回退为纯 AI tool_calls 模式）")
 
-        q = (
-            f"基于已收集的证据，继续深入分析 APK：{apk_path}。\n"
-            "如果已经提取到 dex/拿到 session_id，请从当前 session 继续；"
-            "否则请自行用 tool_calls 重新取证。\n"
-            "目标：定位校验/反调试/加固逻辑，输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
-        )
-        _run_ai_question(ctx, q, mode="strict")
+        _run_ai_question(ctx, _APK_PROMPT_TMPL.format(path=apk_path), mode="strict")
         return True
     if raw.startswith("dex_analyze "):
         analysis_mode, path = _parse_flag_and_path(raw, "dex_analyze")
@@ -506,17 +562,13 @@ def handle_workflows(raw: str, ctx: CommandContext) -> bool:
             if ctx.active_session_id:
                 print_info("[dex_analyze] 2) basic analyze + strings/classes snapshot")
                 _call_tool("r2_analyze_target", {"session_id": ctx.active_session_id, "strategy": "basic"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "i"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "iz"})
+                cmds = ["i", "iz"]
                 if analysis_mode == "deep":
-                    _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "ic"})
+                    cmds.append("ic")
+                _run_r2_batch(ctx.active_session_id, cmds)
         except (requests.RequestException, JsonRpcError, ValueError, TypeError, OSError, RuntimeError, KeyError) as exc:
             print_info(f"[dex_analyze] 固定取证失败：{exc}（将回退为纯 AI tool_calls 模式）")
-        q = (
-            f"继续深入分析 DEX：{path}\n"
-            "目标：定位关键类/关键字符串/验证入口；输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
-        )
-        _run_ai_question(ctx, q, mode="strict")
+        _run_ai_question(ctx, _DEX_PROMPT_TMPL.format(path=path), mode="strict")
         return True
     if raw.startswith("so_analyze "):
         analysis_mode, path = _parse_flag_and_path(raw, "so_analyze")
@@ -533,18 +585,12 @@ def handle_workflows(raw: str, ctx: CommandContext) -> bool:
             if ctx.active_session_id:
                 print_info("[so_analyze] 2) basic analyze + imports/exports/functions snapshot")
                 _call_tool("r2_analyze_target", {"session_id": ctx.active_session_id, "strategy": "basic"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "i"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "iI"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "iE"})
-                _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "afl"})
+                cmds = ["i", "iI", "iE", "afl"]
                 if analysis_mode == "deep":
-                    _call_tool("r2_run_command", {"session_id": ctx.active_session_id, "command": "aaa"})
+                    cmds.append("aaa")
+                _run_r2_batch(ctx.active_session_id, cmds)
         except (requests.RequestException, JsonRpcError, ValueError, TypeError, OSError, RuntimeError, KeyError) as exc:
             print_info(f"[so_analyze] 固定取证失败：{exc}（将回退为纯 AI tool_calls 模式）")
-        q = (
-            f"继续深入分析 native so：{path}\n"
-            "目标：优先分析导入导出/JNI/反调试/加密校验迹象；输出最终 Markdown（## 关键发现/## 证据来源/## 下一步建议）。"
-        )
-        _run_ai_question(ctx, q, mode="strict")
+        _run_ai_question(ctx, _SO_PROMPT_TMPL.format(path=path), mode="strict")
         return True
     return False
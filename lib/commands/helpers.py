@@ -6,16 +6,18 @@ from typing import Any
 
 
 def extract_session_ids(obj: Any) -> set[str]:
+    # 输入来自 JSON 反序列化，必为精确的 dict/list/str：type is 比 isinstance 少走 MRO
     found: set[str] = set()
-    if isinstance(obj, dict):
+    t = type(obj)
+    if t is dict:
         for k, v in obj.items():
-            if k == "session_id" and isinstance(v, str) and v.startswith("session_"):
+            if k == "session_id" and type(v) is str and v.startswith("session_"):
                 found.add(v)
             found.update(extract_session_ids(v))
-    elif isinstance(obj, list):
+    elif t is list:
         for it in obj:
             found.update(extract_session_ids(it))
-    elif isinstance(obj, str):
+    elif t is str:
         for sid in re.findall(r"session_[A-Za-z0-9_]+", obj):
             found.add(sid)
     return found
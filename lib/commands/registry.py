@@ -6,9 +6,15 @@ import requests
 
 from lib.bridge import JsonRpcError
 from lib.commands.context import CommandContext
+from lib.ui_core import print_info
 
 Handler = Callable[[str, CommandContext], bool]
 
+# 预期内的失败（网络/桥接/IO）：处理器内部已自行提示，这里静默吞掉即可
+_SWALLOW = (requests.RequestException, JsonRpcError, OSError)
+# 疑似处理器 bug：吞掉但打印，避免静默丢失排障线索
+_LOG_AND_SWALLOW = (ValueError, TypeError, KeyError, AttributeError, RuntimeError, AssertionError)
+
 
 class CommandRegistry:
     def __init__(self) -> None:
@@ -18,22 +24,16 @@ class CommandRegistry:
         self._handlers.append(handler)
 
     def dispatch(self, raw: str, ctx: CommandContext) -> bool:
-        for h in self._handlers:
+        handlers = self._handlers
+        for h in handlers:
             try:
                 if h(raw, ctx):
                     return True
             except KeyboardInterrupt:
                 raise
-            except (
-                    requests.RequestException,
-                    JsonRpcError,
-                    ValueError,
-                    TypeError,
-                    KeyError,
-                    AttributeError,
-                    OSError,
-                    RuntimeError,
-                    AssertionError,
-            ):
+            except _SWALLOW:
+                return True
+            except _LOG_AND_SWALLOW as exc:
+                print_info(f"[错误] 命令失败: {exc!r}")
                 return True
         return False
@@ -1,5 +1,7 @@
-# 工具根目录
-R2_DIR = "."
+from pathlib import Path
+
+# 工具根目录（导入时解析为绝对路径，后续 open/exists 免去每次相对路径拼接）
+R2_DIR = Path(".").resolve()
 # R2AIBridge 服务地址
 DEFAULT_BASE_URL = "http://127.0.0.1:5050"
 # MCP/HTTP 请求超时(秒)
@@ -19,10 +21,10 @@ MAX_CONTEXT_MESSAGES = 40
 # 对话上下文最大字符预算(过长裁剪，按证据块保留)
 MAX_CONTEXT_CHARS = 140000
 # 配置持久化路径
-CONFIG_SAVE_PATH = f"{R2_DIR}/config.json"
+CONFIG_SAVE_PATH = str(R2_DIR / "config.json")
 # AI 会话持久化路径
-SESSION_SAVE_PATH = f"{R2_DIR}/session.json"
+SESSION_SAVE_PATH = str(R2_DIR / "session.json")
 # 知识库持久化路径
-KB_SAVE_PATH = f"{R2_DIR}/kb.json"
+KB_SAVE_PATH = str(R2_DIR / "kb.json")
 # Debug 日志（JSONL），由 config.json/CLI 的 debug 命令控制
-DEBUG_LOG_PATH = f"{R2_DIR}/debug.log.jsonl"
+DEBUG_LOG_PATH = str(R2_DIR / "debug.log.jsonl")
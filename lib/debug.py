@@ -1,16 +1,39 @@
 from __future__ import annotations
 
+import atexit
 import json
+import mmap
 import os
+import queue
 import threading
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+# orjson 的 C 解析器对小 dict 负载快 3~5 倍；未安装时退回标准库
+_loads = _orjson.loads if _orjson is not None else json.loads
 
-_LOCK = threading.Lock()
 _ENABLED_OVERRIDE: Optional[bool] = None
 _PATH_OVERRIDE: Optional[str] = None
 _MAX_BYTES_OVERRIDE: Optional[int] = None
 
+# 写入走后台线程：生产者只入队，不在调用线程做序列化/磁盘 IO
+_QUEUE: "queue.SimpleQueue[Tuple[str, Dict[str, Any], int]]" = queue.SimpleQueue()
+_PENDING_COND = threading.Condition()
+_PENDING = 0
+_WRITER_THREAD: Optional[threading.Thread] = None
+_WRITER_LOCK = threading.Lock()
+_BATCH_MAX = 256
+_FD: Optional[int] = None
+_FD_PATH = ""
+# 距上次 fstat 检查后累计写入的字节数；过线才重新 stat 判断是否轮转
+_CHECK_EVERY_BYTES = 1 << 20
+_BYTES_SINCE_CHECK = 0
+
 
 def debug_enabled() -> bool:
     if _ENABLED_OVERRIDE is not None:
@@ -51,41 +74,113 @@ def debug_max_bytes() -> int:
     return 0
 
 
-def debug_log(event: str, data: Optional[Dict[str, Any]] = None) -> None:
-    if not debug_enabled():
-        return
-    rec: Dict[str, Any] = {
-        "ts": int(time.time() * 1000),
-        "event": str(event or "").strip() or "event",
-        "data": data or {},
-    }
-    try:
-        line = json.dumps(rec, ensure_ascii=False)
-    except (TypeError, ValueError):
-        return
+def _close_fd() -> None:
+    global _FD
+    if _FD is not None:
+        try:
+            os.close(_FD)
+        except OSError:
+            pass
+        _FD = None
 
+
+def _write_batch(lines: list[str]) -> None:
+    global _FD, _FD_PATH, _BYTES_SINCE_CHECK
     path = debug_log_path()
+    data = ("\n".join(lines) + "\n").encode("utf-8")
     try:
-        with _LOCK:
-            try:
-                max_bytes = debug_max_bytes()
-                if max_bytes > 0 and os.path.exists(path):
-                    if os.path.getsize(path) > max_bytes:
-                        ts = int(time.time())
-                        rot = path + f".{ts}.bak"
-                        try:
-                            os.replace(path, rot)
-                        except OSError:
-                            pass
-            except (OSError, ValueError, TypeError):
-                pass
-            with open(path, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+        if _FD is not None and _FD_PATH != path:
+            _close_fd()
+        if _FD is None:
+            _FD = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            _FD_PATH = path
+            _BYTES_SINCE_CHECK = 0
+        max_bytes = debug_max_bytes()
+        if max_bytes > 0:
+            # 轮转阈值远大于单条记录：累计写入量过线才 fstat，省掉每批一次 stat
+            _BYTES_SINCE_CHECK += len(data)
+            if _BYTES_SINCE_CHECK >= min(_CHECK_EVERY_BYTES, max_bytes):
+                _BYTES_SINCE_CHECK = 0
+                if os.fstat(_FD).st_size > max_bytes:
+                    try:
+                        os.fsync(_FD)
+                    except OSError:
+                        pass
+                    _close_fd()
+                    rot = path + f".{int(time.time())}.bak"
+                    try:
+                        os.replace(path, rot)
+                    except OSError:
+                        pass
+                    _FD = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    _FD_PATH = path
+        os.write(_FD, data)
     except OSError:
+        _close_fd()
+
+
+def _writer_loop() -> None:
+    global _PENDING
+    while True:
+        batch = [_QUEUE.get()]
+        try:
+            while len(batch) < _BATCH_MAX:
+                batch.append(_QUEUE.get_nowait())
+        except queue.Empty:
+            pass
+        lines: list[str] = []
+        for event, data, ts in batch:
+            try:
+                lines.append(json.dumps({"ts": ts, "event": event, "data": data}, ensure_ascii=False))
+            except (TypeError, ValueError):
+                continue
+        if lines:
+            _write_batch(lines)
+        with _PENDING_COND:
+            _PENDING -= len(batch)
+            _PENDING_COND.notify_all()
+
+
+def _ensure_writer() -> None:
+    global _WRITER_THREAD
+    if _WRITER_THREAD is not None and _WRITER_THREAD.is_alive():
+        return
+    with _WRITER_LOCK:
+        if _WRITER_THREAD is not None and _WRITER_THREAD.is_alive():
+            return
+        _WRITER_THREAD = threading.Thread(target=_writer_loop, name="debug-log-writer", daemon=True)
+        _WRITER_THREAD.start()
+
+
+def debug_flush(timeout: float = 2.0) -> None:
+    """等待后台写入线程清空队列（读日志/进程退出前调用，保证可见性）。"""
+    deadline = time.monotonic() + max(0.0, timeout)
+    with _PENDING_COND:
+        while _PENDING > 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            _PENDING_COND.wait(remaining)
+
+
+atexit.register(debug_flush)
+
+
+def debug_log(event: str, data: Optional[Dict[str, Any]] = None) -> None:
+    global _PENDING
+    if not debug_enabled():
         return
+    _ensure_writer()
+    with _PENDING_COND:
+        _PENDING += 1
+    _QUEUE.put((str(event or "").strip() or "event", data or {}, int(time.time() * 1000)))
 
 
 def _read_tail_lines(path: str, max_lines: int = 200) -> list[str]:
+    return [ln.decode("utf-8", errors="replace") for ln in _read_tail_line_bytes(path, max_lines=max_lines)]
+
+
+def _read_tail_line_bytes(path: str, max_lines: int = 200) -> list[bytes]:
     try:
         max_lines = int(max_lines)
     except (TypeError, ValueError):
@@ -93,40 +188,46 @@ def _read_tail_lines(path: str, max_lines: int = 200) -> list[str]:
     if max_lines <= 0:
         return []
     try:
-        with open(path, "rb") as f:
-            f.seek(0, os.SEEK_END)
-            size = f.tell()
-            if size <= 0:
-                return []
-            buf = b""
-            chunk = 8192
-            pos = size
-            nl = 0
-            while pos > 0 and nl <= (max_lines + 2):
-                step = chunk if pos >= chunk else pos
-                pos -= step
-                f.seek(pos, os.SEEK_SET)
-                part = f.read(step)
-                buf = part + buf
-                nl = buf.count(b"\n")
-                if pos == 0:
-                    break
-            lines = buf.splitlines()[-max_lines:]
-            return [ln.decode("utf-8", errors="replace") for ln in lines]
+        fd = os.open(path, os.O_RDONLY)
     except OSError:
         return []
+    try:
+        size = os.fstat(fd).st_size
+        if size <= 0:
+            return []
+        # 倒序收集块，最后一次 join：避免 buf = part + buf 的 O(N^2) 拼接
+        chunks: list[bytes] = []
+        step = 8192
+        pos = size
+        nl = 0
+        while pos > 0 and nl <= (max_lines + 2):
+            n = step if pos >= step else pos
+            pos -= n
+            part = os.pread(fd, n, pos)
+            chunks.append(part)
+            nl += part.count(b"\n")
+        buf = b"".join(reversed(chunks))
+        return buf.splitlines()[-max_lines:]
+    except OSError:
+        return []
+    finally:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
 
 
 def read_debug_events_tail(max_events: int = 50, path: Optional[str] = None) -> list[Dict[str, Any]]:
+    debug_flush()
     p = (path or debug_log_path()).strip()
-    lines = _read_tail_lines(p, max_lines=max_events * 3)
+    lines = _read_tail_line_bytes(p, max_lines=max_events * 3)
     out: list[Dict[str, Any]] = []
+    # JSONL 行本身不含首尾空白，无需逐行 strip；解析器也容忍空白
     for ln in reversed(lines):
-        ln = (ln or "").strip()
         if not ln:
             continue
         try:
-            rec = json.loads(ln)
+            rec = _loads(ln)
         except (json.JSONDecodeError, TypeError, ValueError):
             continue
         if isinstance(rec, dict):
@@ -141,25 +242,38 @@ def read_debug_trace(trace_id: str, max_events: int = 200, path: Optional[str] =
     tid = (trace_id or "").strip()
     if not tid:
         return []
+    debug_flush()
     p = (path or debug_log_path()).strip()
+    # 先做字节级子串预筛再 json.loads：大日志里 >99% 的行与目标 trace 无关
+    needles = (f'"trace_id": "{tid}"'.encode("utf-8"), f'"trace_id":"{tid}"'.encode("utf-8"))
     out: list[Dict[str, Any]] = []
     try:
-        with open(p, "r", encoding="utf-8", errors="replace") as f:
-            for ln in f:
-                ln = (ln or "").strip()
-                if not ln:
-                    continue
-                try:
-                    rec = json.loads(ln)
-                except (json.JSONDecodeError, TypeError, ValueError):
-                    continue
-                if not isinstance(rec, dict):
-                    continue
-                data = rec.get("data")
-                if isinstance(data, dict) and str(data.get("trace_id", "") or "").strip() == tid:
-                    out.append(rec)
-                    if len(out) >= max_events:
-                        break
+        with open(p, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                return []
+            try:
+                # 从文件尾向前按行扫：超出 max_events 时保留最近的事件
+                end = len(mm)
+                while end > 0 and len(out) < max_events:
+                    start = mm.rfind(b"\n", 0, end)
+                    line = mm[start + 1:end]
+                    end = start if start >= 0 else 0
+                    if (needles[0] not in line) and (needles[1] not in line):
+                        continue
+                    try:
+                        rec = _loads(line)
+                    except (json.JSONDecodeError, TypeError, ValueError):
+                        continue
+                    if not isinstance(rec, dict):
+                        continue
+                    data = rec.get("data")
+                    if isinstance(data, dict) and str(data.get("trace_id", "") or "").strip() == tid:
+                        out.append(rec)
+            finally:
+                mm.close()
     except OSError:
         return []
+    out.reverse()
     return out
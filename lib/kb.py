@@ -1,38 +1,65 @@
 from __future__ import annotations
 
+import bisect
+import itertools
+import json
+import os
 import re
 import time
 from typing import Tuple
 
 from lib.persist import load_json_file, save_json_file
 
+# \u70ed\u8def\u5f84\u6b63\u5219\u7edf\u4e00\u7f16\u8bd1\u4e3a\u6a21\u5757\u5e38\u91cf\uff0c\u7ed5\u5f00 re \u5185\u90e8\u7f13\u5b58\u7684\u54c8\u5e0c\u67e5\u627e
+_TOK_ASCII = re.compile(r"[a-z0-9_]{3,}")
+_TOK_CJK = re.compile(r"[\u4e00-\u9fff]{2,}")
+_WS_RE = re.compile(r"\s+")
+# 单个交替模式一次扫描即可覆盖开/闭标签与 invoke/parameter 变体（均以该前缀开头）
+_DSML_RE = re.compile(r"</?[|｜]DSML[|｜]", re.IGNORECASE)
+_LEADER_RE = re.compile(r"^(?:[-*]|\d+\.)\s+")
+
+
+_H2_RE = re.compile(r"^\s*##\s+(.+?)\s*$")
+# 单槽备忘：同一份 markdown 连续取多个小节时只做一次线性扫描
+_SECTIONS_MEMO: tuple[str, dict[str, str]] = ("", {})
+
 
 def kb_tokens(text: str) -> set[str]:
     t = (text or "").lower()
-    tokens: set[str] = set()
-    for w in re.findall(r"[a-z0-9_]{3,}", t):
-        tokens.add(w)
-    for w in re.findall(r"[\u4e00-\u9fff]{2,}", text or ""):
-        tokens.add(w)
+    tokens: set[str] = set(_TOK_ASCII.findall(t))
+    tokens.update(_TOK_CJK.findall(text or ""))
     return tokens
 
 
-def kb_score_item(query_tokens: set[str], item: dict) -> int:
-    if not query_tokens:
-        return 0
+def kb_item_blob_low(item: dict) -> str:
+    """取条目 question+findings 的小写拼接串；只构建一次，缓存在条目上。"""
+    bl = item.get("_blob_low")
+    if isinstance(bl, str):
+        return bl
     q = str(item.get("question", "") or "")
     findings = item.get("key_findings") or []
     if not isinstance(findings, list):
         findings = []
-    blob = q + "\n" + "\n".join(str(x) for x in findings[:20])
-    blob_low = blob.lower()
-    score = 0
-    for tok in query_tokens:
-        if not tok:
-            continue
-        if tok.lower() in blob_low:
-            score += 3
-    return score
+    bl = "\n".join((q, *map(str, findings[:20]))).lower()
+    item["_blob_low"] = bl
+    return bl
+
+
+def kb_item_tokens(item: dict) -> set[str]:
+    """取条目的 token 集合；首次计算后缓存在条目上（_ 前缀字段不会被持久化）。"""
+    toks = item.get("_tokens")
+    if isinstance(toks, set):
+        return toks
+    toks = kb_tokens(kb_item_blob_low(item))
+    item["_tokens"] = toks
+    return toks
+
+
+def kb_score_item(query_tokens: set[str], item: dict) -> int:
+    if not query_tokens:
+        return 0
+    # 纯集合交集：O(min(Q,N))，免去每条目拼 blob + lower + 逐 token 子串扫描
+    return 3 * len(query_tokens & kb_item_tokens(item))
 
 
 def kb_build_context(
@@ -60,54 +87,67 @@ def kb_build_context(
     for it in picked:
         kid = str(it.get("id", "") or "").strip()
         q = str(it.get("question", "") or "").strip()
+        cands: list[str] = []
         if kid or q:
-            head = f"- {kid} {q}".strip()
-            if used + len(head) + 1 > max_chars:
-                break
-            lines.append(head)
-            used += len(head) + 1
+            cands.append(f"- {kid} {q}".strip())
         findings = it.get("key_findings") or []
-        if isinstance(findings, list) and findings:
+        if isinstance(findings, list):
             for f in findings[:6]:
                 s = str(f).strip()
-                if not s:
-                    continue
-                row = f"  * {s}"
-                if used + len(row) + 1 > max_chars:
-                    break
-                lines.append(row)
-                used += len(row) + 1
+                if s:
+                    cands.append(f"  * {s}")
         md = str(it.get("final_markdown", "") or "").strip()
         if md:
-            excerpt = re.sub(r"\s+", " ", md)[:220]
-            row = f"  * 摘要: {excerpt}..."
-            if used + len(row) + 1 <= max_chars:
-                lines.append(row)
-                used += len(row) + 1
+            excerpt = _WS_RE.sub(" ", md)[:220]
+            cands.append(f"  * 摘要: {excerpt}...")
+        if not cands:
+            continue
+        # 预算判定一次算完：累计长度 + 二分找截断点，循环体基本落在 C 实现里
+        cum = list(itertools.accumulate(len(x) + 1 for x in cands))
+        cut = bisect.bisect_right(cum, max_chars - used)
+        lines.extend(cands[:cut])
+        if cut:
+            used += cum[cut - 1]
+        if cut < len(cands):
+            break
     return "\n".join(lines).strip(), picked
 
 
 def contains_dsml_markup(text: str) -> bool:
-    t = text or ""
-    return (
-            ("<｜DSML｜" in t)
-            or ("<|DSML|" in t)
-            or ("</｜DSML｜" in t)
-            or ("</|DSML|" in t)
-            or (re.search(r"<[|｜]DSML[|｜](invoke|parameter)\b", t, flags=re.IGNORECASE) is not None)
-    )
+    return _DSML_RE.search(text or "") is not None
 
 
-def extract_markdown_section(md: str, heading: str) -> str:
+def index_markdown_sections(md: str) -> dict[str, str]:
+    """一趟扫描把 markdown 按 `## 标题` 切成 {标题: 正文}；同名小节保留首个。"""
     text = (md or "").replace("\r\n", "\n").replace("\r", "\n")
-    if not text.strip():
+    sections: dict[str, str] = {}
+    cur: str | None = None
+    buf: list[str] = []
+    for line in text.split("\n"):
+        m = _H2_RE.match(line)
+        if m:
+            if cur is not None and cur not in sections:
+                sections[cur] = "\n".join(buf)
+            cur = m.group(1)
+            buf = []
+        elif cur is not None:
+            buf.append(line)
+    if cur is not None and cur not in sections:
+        sections[cur] = "\n".join(buf)
+    return sections
+
+
+def extract_markdown_section(md: str, heading: str) -> str:
+    global _SECTIONS_MEMO
+    t = md or ""
+    if not t.strip():
         return ""
-    pat = re.compile(
-        rf"(?m)^\s*##\s+{re.escape(heading)}\s*$\n(.*?)(?=^\s*##\s+|\Z)",
-        flags=re.DOTALL,
-    )
-    m = pat.search(text)
-    return (m.group(1) if m else "").strip()
+    if _SECTIONS_MEMO[0] == t:
+        sections = _SECTIONS_MEMO[1]
+    else:
+        sections = index_markdown_sections(t)
+        _SECTIONS_MEMO = (t, sections)
+    return sections.get(heading, "").strip()
 
 
 def extract_key_findings(md: str, limit: int = 12) -> list[str]:
@@ -119,9 +159,7 @@ def extract_key_findings(md: str, limit: int = 12) -> list[str]:
         line = raw.strip()
         if not line:
             continue
-        line = re.sub(r"^[-*]\s+", "", line)
-        line = re.sub(r"^\d+\.\s+", "", line)
-        line = line.strip()
+        line = _LEADER_RE.sub("", line, 1)
         if not line:
             continue
         out.append(line)
@@ -130,7 +168,45 @@ def extract_key_findings(md: str, limit: int = 12) -> list[str]:
     return out
 
 
+# 侧写文件条数超过该阈值时，合并回主 JSON 快照
+_KB_COMPACT_THRESHOLD = 200
+
+
+def _kb_sidecar_path(kb_path: str) -> str:
+    return kb_path + ".jsonl"
+
+
 def append_kb_item(kb_path: str, item: dict) -> None:
+    # O(1) 追加到 JSONL 侧写文件，不再整库读入重写；读取时与 kb.json 快照合并
+    clean = {k: v for k, v in item.items() if not str(k).startswith("_")}
+    with open(_kb_sidecar_path(kb_path), "a", encoding="utf-8") as f:
+        f.write(json.dumps(clean, ensure_ascii=False) + "\n")
+
+
+def _load_kb_sidecar(kb_path: str) -> list[dict]:
+    out: list[dict] = []
+    try:
+        with open(_kb_sidecar_path(kb_path), "r", encoding="utf-8", errors="replace") as f:
+            for ln in f:
+                ln = ln.strip()
+                if not ln:
+                    continue
+                try:
+                    rec = json.loads(ln)
+                except (json.JSONDecodeError, TypeError, ValueError):
+                    continue
+                if isinstance(rec, dict):
+                    out.append(rec)
+    except OSError:
+        return []
+    return out
+
+
+def compact_kb(kb_path: str) -> None:
+    """把 JSONL 侧写文件合并进 kb.json 快照并清空侧写。"""
+    side = _load_kb_sidecar(kb_path)
+    if not side:
+        return
     kb = load_json_file(kb_path, {"items": []})
     if not isinstance(kb, dict):
         kb = {"items": []}
@@ -138,8 +214,17 @@ def append_kb_item(kb_path: str, item: dict) -> None:
     if not isinstance(items, list):
         items = []
         kb["items"] = items
-    items.append(item)
+    items.extend(side)
+    # 剥掉 _ 前缀的运行期缓存字段，避免把 set 等写进 JSON
+    for it in items:
+        if isinstance(it, dict):
+            for k in [k for k in it.keys() if str(k).startswith("_")]:
+                it.pop(k, None)
     save_json_file(kb_path, kb)
+    try:
+        os.remove(_kb_sidecar_path(kb_path))
+    except OSError:
+        pass
 
 
 def build_kb_item(question: str, final_markdown: str) -> dict:
@@ -154,9 +239,20 @@ def build_kb_item(question: str, final_markdown: str) -> dict:
 
 
 def load_kb_items(kb_path: str) -> Tuple[list[dict], int]:
+    side = _load_kb_sidecar(kb_path)
+    if len(side) >= _KB_COMPACT_THRESHOLD:
+        compact_kb(kb_path)
+        side = []
     kb = load_json_file(kb_path, {"items": []})
-    kb_count = len(kb.get("items", [])) if isinstance(kb, dict) and isinstance(kb.get("items"), list) else 0
+    items = kb.get("items") if isinstance(kb, dict) else None
     kb_items: list[dict] = []
-    if isinstance(kb, dict) and isinstance(kb.get("items"), list):
-        kb_items = [x for x in kb.get("items", []) if isinstance(x, dict)]
-    return kb_items, kb_count
+    # 单趟完成过滤 + token 预计算，不再为计数/过滤各走一遍列表
+    if isinstance(items, list):
+        for x in items:
+            if isinstance(x, dict):
+                kb_item_tokens(x)
+                kb_items.append(x)
+    for it in side:
+        kb_item_tokens(it)
+        kb_items.append(it)
+    return kb_items, len(kb_items)
@@ -4,23 +4,66 @@ from typing import Any, Dict
 
 from lib.cfg_schema import normalize_config
 
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+
+# 进程内解析缓存：key=path，value=(mtime_ns, size, 解析结果)。文件没变就不再读盘+解析
+_JSON_CACHE: dict[str, tuple[int, int, Any]] = {}
+
 
 def load_json_file(path: str, default: Any) -> Any:
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except OSError:
         return default
+    hit = _JSON_CACHE.get(path)
+    if hit is not None and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+        return hit[2]
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data
+        with open(path, "rb") as f:
+            raw = f.read()
+        # 大 KB 文件走 orjson 的 C 解析器，未安装时退回标准库
+        data = _orjson.loads(raw) if _orjson is not None else json.loads(raw)
     except (OSError, json.JSONDecodeError, TypeError, ValueError):
         return default
+    _JSON_CACHE[path] = (st.st_mtime_ns, st.st_size, data)
+    return data
+
+
+def _dumps_bytes(data: Any) -> bytes:
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(data, option=_orjson.OPT_INDENT_2)
+        except (TypeError, ValueError):
+            pass
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
 
 
 def save_json_file(path: str, data: Any) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # 先写临时文件再 os.replace：写到一半崩溃不会留下残缺的正式文件
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(_dumps_bytes(data))
+            f.flush()
+            try:
+                os.fsync(f.fileno())
+            except OSError:
+                pass
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
     if os.name != "nt":
         os.chmod(path, 0o600)
+    # 我们刚改写了文件：显式失效，下次读取重新解析
+    _JSON_CACHE.pop(path, None)
 
 
 def load_config(config_path: str) -> Dict[str, Any]:
@@ -1,6 +1,23 @@
 import json
+import sys
 from typing import Any, Dict, Optional
 
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+_ISERROR_KEYS = frozenset({"isError", "content", "structuredContent"})
+
+
+def _dumps_text(obj: Any) -> str:
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj).decode("utf-8")
+        except (TypeError, ValueError):
+            pass
+    return json.dumps(obj, ensure_ascii=False)
+
 TOOL_SPECS: Dict[str, Dict[str, Any]] = {
     "r2_open_file": {"required": ["file_path"],
                      "properties": {"file_path": {"type": "string"}, "auto_analyze": {"type": "boolean"}}},
@@ -16,7 +33,7 @@ def convert_tools_list_to_specs(tools_list: Any) -> Dict[str, Dict[str, Any]]:
     for item in tools_list:
         if not isinstance(item, dict):
             continue
-        name = str(item.get("name", "")).strip()
+        name = sys.intern(str(item.get("name", "")).strip())
         schema = item.get("inputSchema")
         if not name or not isinstance(schema, dict):
             continue
@@ -26,51 +43,67 @@ def convert_tools_list_to_specs(tools_list: Any) -> Dict[str, Dict[str, Any]]:
             props = {}
         if not isinstance(req, list):
             req = []
-        out[name] = {"required": [str(x) for x in req if isinstance(x, str)], "properties": props}
+        # 工具名/参数名是小而固定的集合：intern 后 dict 查找先比身份即可命中
+        out[name] = {
+            "required": [sys.intern(str(x)) for x in req if isinstance(x, str)],
+            "properties": {sys.intern(str(k)): v for k, v in props.items()},
+        }
     return out
 
 
-def validate_args(tool_name: str, args: Any, tool_specs: Dict[str, Dict[str, Any]]) -> Optional[str]:
-    if tool_name not in tool_specs:
-        return f"未知工具: {tool_name}"
-    spec = tool_specs[tool_name]
-    required = spec.get("required") or []
-    props = spec.get("properties") or {}
-    if not isinstance(args, dict):
-        return "参数必须是 JSON 对象"
+_TYPE_CHECKS = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+}
 
-    extras = [k for k in args.keys() if k not in props]
-    if extras:
-        return f"包含未定义参数: {', '.join(sorted(map(str, extras)))}"
 
-    for k in required:
-        if k not in args:
-            return f"缺少必填参数: {k}"
-        if isinstance(props.get(k), dict) and props[k].get("type") == "string":
-            if not str(args.get(k, "")).strip():
+def _compile_spec_validator(spec: Dict[str, Any]):
+    """按 spec 编译一次校验闭包：required/属性集合/类型检查表都预先算好。"""
+    required = [k for k in (spec.get("required") or [])]
+    props = spec.get("properties") or {}
+    prop_keys = frozenset(props.keys())
+    req_str_keys = {
+        k for k in required
+        if isinstance(props.get(k), dict) and props[k].get("type") == "string"
+    }
+    checks: Dict[str, tuple] = {}
+    for k, ps in props.items():
+        if isinstance(ps, dict):
+            fn = _TYPE_CHECKS.get(ps.get("type"))
+            if fn is not None:
+                checks[k] = (fn, ps.get("type"))
+
+    def _validate(args: Dict[str, Any]) -> Optional[str]:
+        extras = [k for k in args.keys() if k not in prop_keys]
+        if extras:
+            return f"包含未定义参数: {', '.join(sorted(map(str, extras)))}"
+        for k in required:
+            if k not in args:
+                return f"缺少必填参数: {k}"
+            if k in req_str_keys and not str(args.get(k, "")).strip():
                 return f"必填参数 {k} 不能为空"
+        for k, v in args.items():
+            c = checks.get(k)
+            if c is not None and not c[0](v):
+                return f"参数 {k} 类型应为 {c[1]}"
+        return None
 
-    for k, v in args.items():
-        ps = props.get(k)
-        if not isinstance(ps, dict):
-            continue
-        t = ps.get("type")
-        if t == "string":
-            if not isinstance(v, str):
-                return f"参数 {k} 类型应为 string"
-        elif t == "integer":
-            if (not isinstance(v, int)) or isinstance(v, bool):
-                return f"参数 {k} 类型应为 integer"
-        elif t == "boolean":
-            if not isinstance(v, bool):
-                return f"参数 {k} 类型应为 boolean"
-        elif t == "object":
-            if not isinstance(v, dict):
-                return f"参数 {k} 类型应为 object"
-        elif t == "array":
-            if not isinstance(v, list):
-                return f"参数 {k} 类型应为 array"
-    return None
+    return _validate
+
+
+def validate_args(tool_name: str, args: Any, tool_specs: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    spec = tool_specs.get(tool_name) if isinstance(tool_specs, dict) else None
+    if spec is None:
+        return f"未知工具: {tool_name}"
+    if not isinstance(args, dict):
+        return "参数必须是 JSON 对象"
+    validator = spec.get("_validate")
+    if validator is None:
+        validator = spec["_validate"] = _compile_spec_validator(spec)
+    return validator(args)
 
 
 def extract_mcp_error_text(resp: Any) -> str:
@@ -90,7 +123,14 @@ def extract_mcp_error_text(resp: Any) -> str:
                     texts.append(item["text"])
             if texts:
                 return "\n".join(texts).strip()
-        return json.dumps(inner, ensure_ascii=False)
+        # 只有 isError 标志、没有实际内容时不值得整体序列化
+        if (
+                not inner.get("content")
+                and not inner.get("structuredContent")
+                and set(inner.keys()) <= _ISERROR_KEYS
+        ):
+            return '{"isError": true}'
+        return _dumps_text(inner)
     return ""
 
 
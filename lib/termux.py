@@ -1,5 +1,6 @@
+import posixpath
 import shlex
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
 from lib.bridge import R2BridgeClient
 
@@ -14,8 +15,9 @@ def termux_save_script_wrapper(bridge: R2BridgeClient, filename: str, content: s
     if target.endswith("/"):
         return {"error": "termux_save_script 的 filename 不能以 / 结尾", "tool_name": "termux_save_script"}
 
-    is_abs = target.startswith("/")
-    fname = target.rsplit("/", 1)[-1] if "/" in target else target
+    # 目标是 Termux 端的 POSIX 路径，统一用 posixpath 解析（宿主可能是 Windows）
+    is_abs = posixpath.isabs(target)
+    fname = posixpath.basename(target)
     if not fname or fname in {".", ".."}:
         return {"error": "termux_save_script 的 filename 不合法", "tool_name": "termux_save_script", "filename": target}
 
@@ -35,10 +37,30 @@ def termux_save_script_wrapper(bridge: R2BridgeClient, filename: str, content: s
 
     src = f"/data/data/com.termux/files/home/AI/{fname}"
     dst = target
-    dst_dir = dst.rsplit("/", 1)[0] if "/" in dst else "/"
-    cmd = f"mkdir -p {shlex.quote(dst_dir)} && cp -f {shlex.quote(src)} {shlex.quote(dst)} && echo OK"
+    cmd = _copy_command([(src, dst)])
     try:
         r = bridge.call_tool("termux_command", {"command": cmd})
         return {"saved_to_sandbox": resp, "copied_to_path": dst, "copy_result": r}
     except Exception as exc:
         return {"saved_to_sandbox": resp, "copy_error": str(exc), "copy_target": dst}
+
+
+def _copy_command(pairs: List[Tuple[str, str]]) -> str:
+    parts: List[str] = []
+    for src, dst in pairs:
+        dst_dir = posixpath.dirname(dst) or "/"
+        parts.append(f"mkdir -p {shlex.quote(dst_dir)} && cp -f {shlex.quote(src)} {shlex.quote(dst)}")
+    return " && ".join(parts) + " && echo OK"
+
+
+def termux_copy_many(bridge: R2BridgeClient, pairs: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """把多组 (src, dst) 复制合并成一条 shell 命令执行，省掉每次起 shell 的开销。"""
+    cleaned = [(str(s or "").strip(), str(d or "").strip()) for s, d in (pairs or [])]
+    cleaned = [(s, d) for s, d in cleaned if s and d]
+    if not cleaned:
+        return {"error": "termux_copy_many 需要至少一组 (src, dst)", "tool_name": "termux_command"}
+    try:
+        r = bridge.call_tool("termux_command", {"command": _copy_command(cleaned)})
+        return {"copied": [d for _, d in cleaned], "copy_result": r}
+    except Exception as exc:
+        return {"copy_error": str(exc), "copy_targets": [d for _, d in cleaned]}
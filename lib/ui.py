@@ -1,7 +1,12 @@
 from __future__ import annotations
 
+import hashlib
+import heapq
+import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Optional, TYPE_CHECKING
 
 import lib.schema as schema
@@ -29,6 +34,7 @@ from lib.debug import (
     set_debug_log_path,
     set_debug_max_bytes,
 )
+from lib.kb import load_kb_items
 from lib.persist import load_json_file, save_json_file, load_config
 from lib.schema import convert_tools_list_to_specs
 from lib.ui_core import print_info
@@ -36,44 +42,80 @@ from lib.ui_core import print_info
 if TYPE_CHECKING:
     from lib.analyzer import AIAnalyzer
 
+# 打分/解析热路径用到的正则统一编译为模块常量
+_RE_ASCII_TOK = re.compile(r"[a-z0-9_]{3,}")
+_RE_CJK_TOK = re.compile(r"[一-鿿]{2,}")
+# DSML 标记都是固定串：小写一次后做子串检查即可，无需正则引擎
+_DSML_MARKERS = ("<｜dsml｜", "<|dsml|", "</｜dsml｜", "</|dsml|")
+_RE_STRIP_LEAD = re.compile(r"^(?:[-*]\s+|\d+\.\s+)")
+_RE_WS = re.compile(r"\s+")
+
+
+_RE_H2_SECTION = re.compile(r"(?m)^\s*##\s+(.+?)\s*$\n(.*?)(?=^\s*##\s+|\Z)", re.DOTALL)
+
+
+@lru_cache(maxsize=64)
+def _sections_for(md_hash: str, md: str) -> dict[str, str]:
+    """按 `## 标题` 一趟切分 {标题: 正文}；以内容哈希为键做 lru 记忆，
+    同一份报告取多个小节只解析一次。同名小节保留首个。"""
+    sections: dict[str, str] = {}
+    for m in _RE_H2_SECTION.finditer(md):
+        sections.setdefault(m.group(1), m.group(2))
+    return sections
+
 
 def _kb_tokens(text: str) -> set[str]:
     t = (text or "").lower()
-    tokens: set[str] = set()
-    for w in re.findall(r"[a-z0-9_]{3,}", t):
-        tokens.add(w)
-    for w in re.findall(r"[\u4e00-\u9fff]{2,}", text or ""):
-        tokens.add(w)
+    tokens: set[str] = set(_RE_ASCII_TOK.findall(t))
+    tokens.update(_RE_CJK_TOK.findall(text or ""))
     return tokens
 
 
 def _contains_dsml_markup(text: str) -> bool:
-    t = text or ""
-    return (
-            ("<｜DSML｜" in t)
-            or ("<|DSML|" in t)
-            or ("</｜DSML｜" in t)
-            or ("</|DSML|" in t)
-            or (re.search(r"<[|｜]DSML[|｜](invoke|parameter)\b", t, flags=re.IGNORECASE) is not None)
-    )
+    t_low = (text or "").lower()
+    return any(m in t_low for m in _DSML_MARKERS)
 
 
-def _kb_score_item(query_tokens: set[str], item: dict) -> int:
-    if not query_tokens:
-        return 0
+def _kb_item_blob_low(item: dict) -> str:
+    """取条目 question+findings 的小写拼接串；只构建一次，缓存在条目上。"""
+    bl = item.get("_blob_low")
+    if isinstance(bl, str):
+        return bl
     q = str(item.get("question", "") or "")
     findings = item.get("key_findings") or []
     if not isinstance(findings, list):
         findings = []
-    blob = q + "\n" + "\n".join(str(x) for x in findings[:20])
-    blob_low = blob.lower()
-    score = 0
-    for tok in query_tokens:
-        if not tok:
-            continue
-        if tok.lower() in blob_low:
-            score += 3
-    return score
+    bl = (q + "\n" + "\n".join(str(x) for x in findings[:20])).lower()
+    item["_blob_low"] = bl
+    return bl
+
+
+def _kb_item_tokens(item: dict) -> frozenset[str]:
+    """取条目的 token 集合；首次计算后缓存在条目上（_ 前缀字段不会被持久化）。"""
+    toks = item.get("_tokens")
+    if isinstance(toks, frozenset):
+        return toks
+    toks = frozenset(_kb_tokens(_kb_item_blob_low(item)))
+    item["_tokens"] = toks
+    return toks
+
+
+def _kb_item_excerpt(item: dict) -> str:
+    """取 final_markdown 压缩空白后的前 220 字摘要；只算一次，缓存在条目上。"""
+    ex = item.get("_excerpt")
+    if isinstance(ex, str):
+        return ex
+    md = str(item.get("final_markdown", "") or "").strip()
+    ex = _RE_WS.sub(" ", md)[:220] if md else ""
+    item["_excerpt"] = ex
+    return ex
+
+
+def _kb_score_item(query_tokens: set[str], item: dict) -> int:
+    if not query_tokens:
+        return 0
+    # 纯集合交集：近 O(|q_tokens|)，免去每条目逐 token 子串扫描
+    return 3 * len(query_tokens & _kb_item_tokens(item))
 
 
 def _kb_build_context(
@@ -94,37 +136,40 @@ def _kb_build_context(
             scored.append((s, it))
     if not scored:
         return "", []
-    scored.sort(key=lambda x: x[0], reverse=True)
-    picked = [it for _, it in scored[:max_items]]
+    # 只要前 max_items 条，O(N log K) 的堆选择即可，不必整表排序
+    picked = [it for _, it in heapq.nlargest(max_items, scored, key=lambda x: x[0])]
     lines: list[str] = ["【知识库参考（仅供提示，结论需用工具再次取证）】"]
+    lines_append = lines.append
     used = len(lines[0]) + 1
     for it in picked:
         kid = str(it.get("id", "") or "").strip()
         q = str(it.get("question", "") or "").strip()
         if kid or q:
             head = f"- {kid} {q}".strip()
-            if used + len(head) + 1 > max_chars:
+            head_len = len(head) + 1
+            if used + head_len > max_chars:
                 break
-            lines.append(head)
-            used += len(head) + 1
+            lines_append(head)
+            used += head_len
         findings = it.get("key_findings") or []
         if isinstance(findings, list) and findings:
             for f in findings[:6]:
                 s = str(f).strip()
                 if not s:
                     continue
-                row = f"  * {s}"
-                if used + len(row) + 1 > max_chars:
+                # 行长可由片段长度直接推出（"  * " 前缀 4 字符 + 换行 1），超预算时连字符串都不必拼
+                row_len = len(s) + 5
+                if used + row_len > max_chars:
                     break
-                lines.append(row)
-                used += len(row) + 1
-        md = str(it.get("final_markdown", "") or "").strip()
-        if md:
-            excerpt = re.sub(r"\s+", " ", md)[:220]
+                lines_append("  * " + s)
+                used += row_len
+        excerpt = _kb_item_excerpt(it)
+        if excerpt:
             row = f"  * 摘要: {excerpt}..."
-            if used + len(row) + 1 <= max_chars:
-                lines.append(row)
-                used += len(row) + 1
+            row_len = len(row) + 1
+            if used + row_len <= max_chars:
+                lines_append(row)
+                used += row_len
     return "\n".join(lines).strip(), picked
 
 
@@ -132,12 +177,8 @@ def _extract_markdown_section(md: str, heading: str) -> str:
     text = (md or "").replace("\r\n", "\n").replace("\r", "\n")
     if not text.strip():
         return ""
-    pat = re.compile(
-        rf"(?m)^\s*##\s+{re.escape(heading)}\s*$\n(.*?)(?=^\s*##\s+|\Z)",
-        flags=re.DOTALL,
-    )
-    m = pat.search(text)
-    return (m.group(1) if m else "").strip()
+    h = hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+    return _sections_for(h, text).get(heading, "").strip()
 
 
 def _extract_key_findings(md: str, limit: int = 12) -> list[str]:
@@ -149,9 +190,7 @@ def _extract_key_findings(md: str, limit: int = 12) -> list[str]:
         line = raw.strip()
         if not line:
             continue
-        line = re.sub(r"^[-*]\s+", "", line)
-        line = re.sub(r"^\d+\.\s+", "", line)
-        line = line.strip()
+        line = _RE_STRIP_LEAD.sub("", line, 1).strip()
         if not line:
             continue
         out.append(line)
@@ -160,16 +199,30 @@ def _extract_key_findings(md: str, limit: int = 12) -> list[str]:
     return out
 
 
-def _append_kb_item(kb_path: str, item: dict) -> None:
-    kb = load_json_file(kb_path, {"items": []})
-    if not isinstance(kb, dict):
-        kb = {"items": []}
-    items = kb.get("items")
-    if not isinstance(items, list):
-        items = []
-        kb["items"] = items
-    items.append(item)
-    save_json_file(kb_path, kb)
+def _load_and_prep_kb(kb_path: str) -> list[dict]:
+    """加载知识库并做 token/摘要预计算；在后台线程跑，与启动交互并行。
+
+    写入走 kb.append_kb_item 的 JSONL 侧写文件，这里必须用 load_kb_items
+    把快照与侧写合并（必要时触发合并压缩），否则上一会话保存的条目会丢失。
+    """
+    items, _count = load_kb_items(kb_path)
+    kb_items: list[dict] = []
+    for x in items:
+        if isinstance(x, dict):
+            # 条目在会话内不会变：启动时把小写 blob、token 集合和摘要算好，免得每次提问重算
+            _kb_item_tokens(x)
+            _kb_item_excerpt(x)
+            kb_items.append(x)
+    return kb_items
+
+
+def _config_signature(cfg: dict) -> Optional[bytes]:
+    """配置内容的稳定摘要：写盘前比对，内容没变就跳过磁盘写入。"""
+    try:
+        payload = json.dumps(cfg, ensure_ascii=False, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
 
 
 def print_help() -> None:
@@ -200,12 +253,9 @@ def print_help() -> None:
 
 def main() -> None:
     from lib.analyzer import AIAnalyzer
-    kb = load_json_file(KB_SAVE_PATH, {"items": []})
-    kb_count = len(kb.get("items", [])) if isinstance(kb, dict) and isinstance(kb.get("items"), list) else 0
-    print_info(f"[知识库] 已加载: {KB_SAVE_PATH} (共 {kb_count} 条)")
-    kb_items: list[dict] = []
-    if isinstance(kb, dict) and isinstance(kb.get("items"), list):
-        kb_items = [x for x in kb.get("items", []) if isinstance(x, dict)]
+    # 知识库加载+预计算与后面的配置交互/tools/list 请求无依赖，丢到后台线程并行
+    kb_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-prep")
+    kb_future = kb_executor.submit(_load_and_prep_kb, KB_SAVE_PATH)
 
     raw_cfg = load_json_file(CONFIG_SAVE_PATH, None)
     saved = load_config(CONFIG_SAVE_PATH)
@@ -386,8 +436,12 @@ def main() -> None:
         "DANGEROUS_EXTRA_DENY_REGEX": str(saved.get("DANGEROUS_EXTRA_DENY_REGEX", "") or ""),
         "DEBUG_MAX_BYTES": int(saved.get("DEBUG_MAX_BYTES", 0) or 0),
     }
-    save_json_file(CONFIG_SAVE_PATH, current_config)
-    print("[配置] 已在启动时保存当前配置，下次可直接复用。")
+    cfg_sig = _config_signature(current_config)
+    if cfg_sig is None or cfg_sig != _config_signature(raw_cfg if isinstance(raw_cfg, dict) else {}):
+        save_json_file(CONFIG_SAVE_PATH, current_config)
+        print("[配置] 已在启动时保存当前配置，下次可直接复用。")
+    else:
+        print("[配置] 配置与磁盘一致，跳过重写。")
 
     analyzer: Optional[AIAnalyzer] = None
     if api_key:
@@ -421,6 +475,14 @@ def main() -> None:
         except Exception as exc:
             print(f"[警告] AI 初始化失败，将仅保留手动 call 模式: {exc}")
 
+    try:
+        kb_items: list[dict] = kb_future.result()
+    except Exception as exc:
+        print_info(f"[警告] 知识库加载失败，已按空库继续: {exc}")
+        kb_items = []
+    kb_executor.shutdown(wait=False)
+    print_info(f"[知识库] 已加载: {KB_SAVE_PATH} (共 {len(kb_items)} 条)")
+
     ctx = CommandContext(
         bridge=bridge,
         schema_module=schema,
@@ -462,8 +524,10 @@ def main() -> None:
             if reg.dispatch(raw, ctx):
                 if ctx.should_exit:
                     try:
-                        save_json_file(CONFIG_SAVE_PATH, current_config)
-                        print("[配置] 当前配置已保存。")
+                        exit_sig = _config_signature(current_config)
+                        if exit_sig is None or exit_sig != cfg_sig:
+                            save_json_file(CONFIG_SAVE_PATH, current_config)
+                            print("[配置] 当前配置已保存。")
                     except (OSError, TypeError, ValueError) as exc:
                         print(f"[警告] 配置保存失败: {exc}")
                     if ctx.analyzer is not None:
@@ -1,10 +1,12 @@
+import bisect
+import codecs
 import shutil
+import signal
 import sys
+import threading
 import time
 from typing import Any, Optional, TYPE_CHECKING
 
-import unicodedata
-
 if TYPE_CHECKING:
     from rich.live import Live as RichLiveType
 else:
@@ -17,17 +19,105 @@ try:
     from rich.text import Text
 
     RICH_AVAILABLE = True
-    CONSOLE = Console()
 except ImportError:
     Console = None
     RichLive = None
     Markdown = None
     Text = None
     RICH_AVAILABLE = False
-    CONSOLE = None
+
+_CONSOLE: Optional[Any] = None
+
+
+def _console() -> Optional[Any]:
+    """Console 构造会探测终端/扫描环境变量，推迟到首次真正输出时再做。"""
+    global _CONSOLE
+    if _CONSOLE is None and RICH_AVAILABLE and Console is not None:
+        _CONSOLE = Console()
+    return _CONSOLE
 
 _RICH_BROKEN = False
 
+# 东亚宽字符（east_asian_width 为 W/F）的码点区间，展平成有序端点表后
+# 用 bisect 判定：奇数下标落在区间内。免去逐字符调 unicodedata 的开销。
+# 表由 unicodedata（UCD 14.0）按 W/F 且已指派的码点逐个生成，与
+# east_asian_width 在全部已指派字符上完全一致（覆盖 ⌚✅❌☕ 等
+# 0x2300–0x2E7F 段的宽表情）；相邻区间之间全是未指派码点时合并成一段
+_WIDE_RANGES = (
+    (0x1100, 0x115F), (0x231A, 0x231B), (0x2329, 0x232A), (0x23E9, 0x23EC),
+    (0x23F0, 0x23F0), (0x23F3, 0x23F3), (0x25FD, 0x25FE), (0x2614, 0x2615),
+    (0x2648, 0x2653), (0x267F, 0x267F), (0x2693, 0x2693), (0x26A1, 0x26A1),
+    (0x26AA, 0x26AB), (0x26BD, 0x26BE), (0x26C4, 0x26C5), (0x26CE, 0x26CE),
+    (0x26D4, 0x26D4), (0x26EA, 0x26EA), (0x26F2, 0x26F3), (0x26F5, 0x26F5),
+    (0x26FA, 0x26FA), (0x26FD, 0x26FD), (0x2705, 0x2705), (0x270A, 0x270B),
+    (0x2728, 0x2728), (0x274C, 0x274C), (0x274E, 0x274E), (0x2753, 0x2755),
+    (0x2757, 0x2757), (0x2795, 0x2797), (0x27B0, 0x27B0), (0x27BF, 0x27BF),
+    (0x2B1B, 0x2B1C), (0x2B50, 0x2B50), (0x2B55, 0x2B55), (0x2E80, 0x303E),
+    (0x3041, 0x3247), (0x3250, 0x4DBF), (0x4E00, 0xA4C6), (0xA960, 0xA97C),
+    (0xAC00, 0xD7A3), (0xF900, 0xFAD9), (0xFE10, 0xFE19), (0xFE30, 0xFE6B),
+    (0xFF01, 0xFF60), (0xFFE0, 0xFFE6), (0x16FE0, 0x1B2FB), (0x1F004, 0x1F004),
+    (0x1F0CF, 0x1F0CF), (0x1F18E, 0x1F18E), (0x1F191, 0x1F19A), (0x1F200, 0x1F320),
+    (0x1F32D, 0x1F335), (0x1F337, 0x1F37C), (0x1F37E, 0x1F393), (0x1F3A0, 0x1F3CA),
+    (0x1F3CF, 0x1F3D3), (0x1F3E0, 0x1F3F0), (0x1F3F4, 0x1F3F4), (0x1F3F8, 0x1F43E),
+    (0x1F440, 0x1F440), (0x1F442, 0x1F4FC), (0x1F4FF, 0x1F53D), (0x1F54B, 0x1F54E),
+    (0x1F550, 0x1F567), (0x1F57A, 0x1F57A), (0x1F595, 0x1F596), (0x1F5A4, 0x1F5A4),
+    (0x1F5FB, 0x1F64F), (0x1F680, 0x1F6C5), (0x1F6CC, 0x1F6CC), (0x1F6D0, 0x1F6D2),
+    (0x1F6D5, 0x1F6DF), (0x1F6EB, 0x1F6EC), (0x1F6F4, 0x1F6FC), (0x1F7E0, 0x1F7F0),
+    (0x1F90C, 0x1F93A), (0x1F93C, 0x1F945), (0x1F947, 0x1F9FF), (0x1FA70, 0x1FAF6),
+    (0x20000, 0x3134A),
+)
+_WIDE_BOUNDS = tuple(b for lo, hi in _WIDE_RANGES for b in (lo, hi + 1))
+
+# 非 rich 流式输出直接写底层字节缓冲：整块编码一次，绕开 TextIOWrapper
+# 的逐次增量编码；stdout 不是 UTF-8 或被替换（如测试里的 StringIO）时退回文本写
+_UTF8_ENCODE = codecs.getencoder("utf-8")
+
+
+def _write_stdout_raw(chunk: str) -> None:
+    out = sys.stdout
+    buf = getattr(out, "buffer", None)
+    if buf is not None and str(getattr(out, "encoding", "") or "").lower().replace("-", "") == "utf8":
+        try:
+            out.flush()
+            buf.write(_UTF8_ENCODE(chunk)[0])
+            buf.flush()
+            return
+        except (OSError, ValueError):
+            pass
+    out.write(chunk)
+    out.flush()
+
+
+# 流式输出各前缀的展示样式；查表取代逐个 elif 比较
+_PREFIX_STYLES = {
+    "[思考]": "yellow",
+    "[回答]": "bold green",
+    "[提示]": "cyan",
+    "[工具调用]": "bold cyan",
+}
+
+# 终端宽度缓存 [列数, 上次探测时刻]：避免流式输出期间反复 ioctl(TIOCGWINSZ)
+_TERM_W_CACHE: list = [0, 0.0]
+_TERM_W_TTL_S = 0.5
+_WINCH_HOOKED = False
+
+
+def _invalidate_term_width(*_args: Any) -> None:
+    _TERM_W_CACHE[1] = 0.0
+
+
+def _hook_sigwinch() -> None:
+    """窗口尺寸变化时让缓存立即失效；只在主线程装一次，失败则靠 TTL 兜底。"""
+    global _WINCH_HOOKED
+    if _WINCH_HOOKED or not hasattr(signal, "SIGWINCH"):
+        return
+    try:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGWINCH, _invalidate_term_width)
+            _WINCH_HOOKED = True
+    except (ValueError, OSError, RuntimeError):
+        pass
+
 
 def _disable_rich_runtime() -> None:
     global _RICH_BROKEN
@@ -35,9 +125,10 @@ def _disable_rich_runtime() -> None:
 
 
 def print_info(text: str) -> None:
-    if RICH_AVAILABLE and (not _RICH_BROKEN) and CONSOLE is not None:
+    console = _console() if RICH_AVAILABLE and (not _RICH_BROKEN) else None
+    if console is not None:
         try:
-            CONSOLE.print(text, markup=False, highlight=False, soft_wrap=True)
+            console.print(text, markup=False, highlight=False, soft_wrap=True)
             return
         except (ModuleNotFoundError, ImportError, AttributeError, TypeError, ValueError, OSError):
             _disable_rich_runtime()
@@ -45,9 +136,10 @@ def print_info(text: str) -> None:
 
 
 def print_markdown(text: str) -> None:
-    if RICH_AVAILABLE and (not _RICH_BROKEN) and CONSOLE is not None and Markdown is not None:
+    console = _console() if RICH_AVAILABLE and (not _RICH_BROKEN) and Markdown is not None else None
+    if console is not None:
         try:
-            CONSOLE.print(Markdown(text))
+            console.print(Markdown(text))
             return
         except (ModuleNotFoundError, ImportError, AttributeError, TypeError, ValueError, OSError):
             _disable_rich_runtime()
@@ -58,28 +150,39 @@ class AdaptiveStreamWriter:
     def __init__(self, min_width: int = 24):
         self.current_col = 0
         self.min_width = min_width
-        self._use_rich = bool(RICH_AVAILABLE and CONSOLE is not None and Text is not None)
+        self._use_rich = bool(RICH_AVAILABLE and Text is not None)
         self._md_enabled = False
-        self._md_buffer = ""
+        # 未稳定尾部按块累积，渲染时才 join；总长单独计数用于重渲染门限
+        self._md_chunks: list = []
+        self._md_len = 0
         self._md_last_ts = 0.0
         self._md_last_len = 0
         self._md_live: Optional[RichLiveType] = None
+        _hook_sigwinch()
 
     def _terminal_width(self) -> int:
+        now = time.monotonic()
+        if _TERM_W_CACHE[0] > 0 and (now - _TERM_W_CACHE[1]) < _TERM_W_TTL_S:
+            return max(_TERM_W_CACHE[0], self.min_width)
         try:
             cols = shutil.get_terminal_size(fallback=(100, 24)).columns
         except OSError:
             cols = 100
+        _TERM_W_CACHE[0] = cols
+        _TERM_W_CACHE[1] = now
         return max(cols, self.min_width)
 
     @staticmethod
     def _char_width(ch: str) -> int:
-        return 2 if unicodedata.east_asian_width(ch) in {"W", "F"} else 1
+        cp = ord(ch)
+        if cp < 0x1100:
+            return 1
+        return 2 if (bisect.bisect_right(_WIDE_BOUNDS, cp) & 1) else 1
 
     def enable_markdown_stream(self) -> bool:
         if _RICH_BROKEN:
             return False
-        if (not self._use_rich) or (CONSOLE is None) or (Markdown is None) or (RichLive is None):
+        if (not self._use_rich) or (Markdown is None) or (RichLive is None):
             return False
         try:
             if not sys.stdout.isatty():
@@ -89,14 +192,15 @@ class AdaptiveStreamWriter:
         if self._md_enabled:
             return True
         self._md_enabled = True
-        self._md_buffer = ""
+        self._md_chunks = []
+        self._md_len = 0
         self._md_last_ts = 0.0
         self._md_last_len = 0
         try:
             self._md_live = RichLive(
                 Markdown(""),
-                console=CONSOLE,
-                refresh_per_second=6,
+                console=_console(),
+                refresh_per_second=4,
                 transient=True,
             )
             self._md_live.start()
@@ -112,7 +216,7 @@ class AdaptiveStreamWriter:
             return
         if self._md_live is not None and Markdown is not None:
             try:
-                self._md_live.update(Markdown(self._md_buffer or ""))
+                self._md_live.update(Markdown("".join(self._md_chunks)))
             except (ModuleNotFoundError, ImportError, TypeError, ValueError, OSError, AttributeError):
                 _disable_rich_runtime()
                 pass
@@ -123,76 +227,98 @@ class AdaptiveStreamWriter:
                 pass
         self._md_live = None
         self._md_enabled = False
-        self._md_buffer = ""
+        self._md_chunks = []
+        self._md_len = 0
         self._md_last_ts = 0.0
         self._md_last_len = 0
 
     def is_markdown_streaming(self) -> bool:
         return bool(self._md_enabled)
 
-    def _maybe_render_markdown(self) -> None:
+    def _maybe_render_markdown(self, force: bool = False) -> None:
         if (not self._md_enabled) or (self._md_live is None) or (Markdown is None):
             return
         now = time.time()
-        if (len(self._md_buffer) - self._md_last_len) < 80 and (now - self._md_last_ts) < 0.15:
-            return
+        n = self._md_len
+        # 中文下 80 字符只有一两行可见内容：门限抬到 240 字符/0.30 秒，
+        # 并随缓冲增长继续放宽；段落边界（force）则无视门限立即刷新
+        if not force:
+            gate_chars = min(256, 240 + n // 256)
+            gate_secs = min(0.5, 0.30 + n / 200000)
+            if (n - self._md_last_len) < gate_chars and (now - self._md_last_ts) < gate_secs:
+                return
         try:
-            self._md_live.update(Markdown(self._md_buffer))
+            # 最近一个段落边界之前的内容已稳定：渲染一次固化到控制台，
+            # Live 只重解析未稳定的尾部，避免整段缓冲的 O(N^2) 重解析
+            buf = "".join(self._md_chunks)
+            boundary = buf.rfind("\n\n")
+            if boundary > 0 and buf.count("```", 0, boundary) % 2 == 0:
+                stable = buf[:boundary]
+                console = _console()
+                if stable.strip() and console is not None:
+                    console.print(Markdown(stable))
+                buf = buf[boundary + 2:]
+            self._md_chunks = [buf]
+            self._md_live.update(Markdown(buf))
         except (ModuleNotFoundError, ImportError, TypeError, ValueError, OSError, AttributeError):
             _disable_rich_runtime()
             return
         self._md_last_ts = now
-        self._md_last_len = len(self._md_buffer)
+        self._md_last_len = n
 
     def write(self, text: str) -> None:
         if self._md_enabled:
             out = (text or "").replace("\r", "")
             if out:
-                self._md_buffer += out
-                self._maybe_render_markdown()
+                self._md_chunks.append(out)
+                self._md_len += len(out)
+                self._maybe_render_markdown(force=("\n\n" in out))
             return
-        if self._use_rich and CONSOLE is not None:
+        console = _console() if self._use_rich else None
+        if console is not None:
             out = (text or "").replace("\r", "")
             if out:
-                CONSOLE.print(out, end="", markup=False, highlight=False, soft_wrap=True)
+                console.print(out, end="", markup=False, highlight=False, soft_wrap=True)
             return
+        # 单趟算好折行位置，整块一次写出，不再每字符各走一次 stdout.write
+        term_w = self._terminal_width()
+        char_width = self._char_width
+        col = self.current_col
+        parts: list[str] = []
+        append = parts.append
         for ch in text:
             if ch == "\r":
                 continue
             if ch == "\n":
-                sys.stdout.write("\n")
-                self.current_col = 0
+                append("\n")
+                col = 0
                 continue
-            width = self._char_width(ch)
-            if self.current_col + width > self._terminal_width():
-                sys.stdout.write("\n")
-                self.current_col = 0
-            sys.stdout.write(ch)
-            self.current_col += width
-        sys.stdout.flush()
+            width = char_width(ch)
+            if col + width > term_w:
+                append("\n")
+                col = 0
+            append(ch)
+            col += width
+        if parts:
+            _write_stdout_raw("".join(parts))
+        self.current_col = col
 
     def write_prefix(self, prefix: str) -> None:
         if self.current_col != 0:
             self.write("\n")
-        if self._use_rich and CONSOLE is not None and Text is not None:
-            style = None
-            if prefix.strip() == "[思考]":
-                style = "yellow"
-            elif prefix.strip() == "[回答]":
-                style = "bold green"
-            elif prefix.strip() == "[提示]":
-                style = "cyan"
-            elif prefix.strip() == "[工具调用]":
-                style = "bold cyan"
+        console = _console() if self._use_rich and Text is not None else None
+        if console is not None:
+            style = _PREFIX_STYLES.get(prefix.strip())
             t = Text(prefix, style=style) if style else Text(prefix)
-            CONSOLE.print(t, end="", highlight=False, soft_wrap=True)
+            console.print(t, end="", highlight=False, soft_wrap=True)
         else:
             self.write(prefix)
 
     def newline(self) -> None:
         if self.current_col != 0:
-            if self._use_rich and CONSOLE is not None:
-                CONSOLE.print()
+            console = _console() if self._use_rich else None
+            if console is not None:
+                console.print()
             else:
                 sys.stdout.write("\n")
                 sys.stdout.flush()
@@ -1,12 +1,7 @@
+import copy
 import json
-import os
-import sys
 import unittest
 
-ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-if ROOT not in sys.path:
-    sys.path.insert(0, ROOT)
-
 
 class StabilityTests(unittest.TestCase):
     class _DummyClient:
@@ -15,11 +10,31 @@ class StabilityTests(unittest.TestCase):
     class _DummyBridge:
         pass
 
+    @classmethod
+    def setUpClass(cls) -> None:
+        # 构造一次模板实例，各测试浅拷贝后只改自己关心的属性，
+        # 省掉每个用例重复走一遍 __init__（system prompt 构建等）
+        from lib.analyzer import AIAnalyzer
+
+        cls._template = AIAnalyzer(
+            api_key="x",
+            model="m",
+            base_url="http://example.invalid",
+            tool_specs={},
+            client_override=cls._DummyClient(),
+        )
+
+    def _fresh_analyzer(self, **attrs):
+        a = copy.copy(self._template)
+        a.messages = list(self._template.messages)
+        for k, v in attrs.items():
+            setattr(a, k, v)
+        return a
+
     def test_compact_text_output_keeps_head_tail(self) -> None:
         from lib.analyzer import AIAnalyzer
 
-        lines = [f"line{i}" for i in range(300)]
-        text = "\n".join(lines)
+        text = "\n".join("line%d" % i for i in range(300))
         out = AIAnalyzer._compact_text_output(text, head_lines=5, tail_lines=7, max_chars=10_000)
         self.assertIn("line0", out)
         self.assertIn("line4", out)
@@ -27,16 +42,8 @@ class StabilityTests(unittest.TestCase):
         self.assertIn("...(中间省略", out)
 
     def test_compact_tool_result_termux_command(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-        )
-        long_stdout = "\n".join([f"out{i}" for i in range(400)])
+        a = self._fresh_analyzer()
+        long_stdout = "\n".join("out%d" % i for i in range(400))
         result = {"stdout": long_stdout, "stderr": "", "exit_code": 0}
         out = a._compact_tool_result("termux_command", result)
         self.assertIsInstance(out, dict)
@@ -45,17 +52,7 @@ class StabilityTests(unittest.TestCase):
         self.assertIn("out399", out["stdout"])
 
     def test_trim_messages_does_not_start_with_tool(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-            max_context_chars=1200,
-            max_context_messages=50,
-        )
+        a = self._fresh_analyzer(max_context_chars=1200, max_context_messages=50)
         a.messages = [
             {"role": "system", "content": "sys"},
             {"role": "assistant", "content": "a0",
@@ -71,17 +68,8 @@ class StabilityTests(unittest.TestCase):
             self.assertNotEqual(a.messages[1].get("role"), "tool")
 
     def test_trim_messages_trims_by_chars_even_if_count_ok(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-            max_context_chars=1000,
-            max_context_messages=999,  # count won't trigger
-        )
+        # count won't trigger
+        a = self._fresh_analyzer(max_context_chars=1000, max_context_messages=999)
         a.messages = [
             {"role": "system", "content": "sys"},
             {"role": "user", "content": "U" * 800},
@@ -95,17 +83,7 @@ class StabilityTests(unittest.TestCase):
         self.assertEqual(a.messages[0].get("role"), "system")
 
     def test_trim_messages_preserves_tool_pairing(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-            max_context_chars=1400,
-            max_context_messages=999,
-        )
+        a = self._fresh_analyzer(max_context_chars=1400, max_context_messages=999)
         a.messages = [
             {"role": "system", "content": "sys"},
             {"role": "assistant", "content": "a0",
@@ -131,17 +109,7 @@ class StabilityTests(unittest.TestCase):
                 self.assertIn(msg.get("tool_call_id"), allowed)
 
     def test_sanitize_drops_unresponded_tool_calls(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-            max_context_chars=999999,
-            max_context_messages=999,
-        )
+        a = self._fresh_analyzer(max_context_chars=999999, max_context_messages=999)
         a.messages = [
             {"role": "system", "content": "sys"},
             {"role": "assistant", "content": "", "tool_calls": [
@@ -162,15 +130,7 @@ class StabilityTests(unittest.TestCase):
         self.assertNotIn("tc2", ids)
 
     def test_recoverable_guidance_mentions_last_r2_file_path(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-        )
+        a = self._fresh_analyzer()
         a.last_r2_file_path = "/storage/emulated/0/a.so"
         g = a._recoverable_guidance(["r2_disassemble: Invalid session_id: session_xxx"])
         self.assertIn("r2_open_file", g)
@@ -194,14 +154,9 @@ class StabilityTests(unittest.TestCase):
         )
 
     def test_dashscope_thinking_merges_extra_body(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
+        a = self._fresh_analyzer(
             model="qwen-plus",
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-            tool_specs={},
-            client_override=self._DummyClient(),
             enable_search=True,
             enable_thinking=True,
             thinking_budget=50,
@@ -242,34 +197,22 @@ class StabilityTests(unittest.TestCase):
         self.assertTrue(AIAnalyzer._model_supports_enable_thinking("deepseek-v3.2"))
 
     def test_use_text_tool_mode_dashscope_distill(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
+        a = self._fresh_analyzer(
             model="deepseek-r1-distill-llama-8b",
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-            tool_specs={},
-            client_override=self._DummyClient(),
         )
         self.assertTrue(a._use_text_tool_mode())
-        b = AIAnalyzer(
-            api_key="x",
+        b = self._fresh_analyzer(
             model="qwen-plus",
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-            tool_specs={},
-            client_override=self._DummyClient(),
         )
         self.assertFalse(b._use_text_tool_mode())
 
     def test_deepseek_distill_skips_thinking_when_tools(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
+        a = self._fresh_analyzer(
             model="deepseek-r1-distill-llama-8b",
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
             tool_specs={"t": {"properties": {}, "required": []}},
-            client_override=self._DummyClient(),
             enable_thinking=True,
             thinking_budget=50,
         )
@@ -280,17 +223,7 @@ class StabilityTests(unittest.TestCase):
 
     def test_trim_never_leaves_orphan_assistant_with_tool_calls(self) -> None:
         """裁剪后不得留下孤立的 assistant(tool_calls)，否则会触发 Invalid consecutive assistant message"""
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-            max_context_messages=5,
-            max_context_chars=999999,
-        )
+        a = self._fresh_analyzer(max_context_messages=5, max_context_chars=999999)
         # 构造：裁剪后 tail 末尾可能是 assistant(tool_calls) 且无 tool 响应
         a.messages = [
             {"role": "system", "content": "sys"},
@@ -321,15 +254,7 @@ class StabilityTests(unittest.TestCase):
                 self.fail(f"assistant at {i} has tool_calls but next is {next_msg.get('role')}")
 
     def test_recoverable_prompt_mentions_success_tools(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-        )
+        a = self._fresh_analyzer()
         text = a._build_recoverable_prompt(
             success_tool_names=["termux_command", "r2_open_file"],
             recoverable_errors=["r2_run_command: session invalid"],
@@ -340,15 +265,7 @@ class StabilityTests(unittest.TestCase):
         self.assertIn("不要重复", text)
 
     def test_nonrecoverable_guidance_rate_limit(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-        )
+        a = self._fresh_analyzer()
         g = a._nonrecoverable_guidance(["termux_command: 429 Too Many Requests"])
         self.assertTrue(("限流" in g) or ("429" in g))
 
@@ -360,17 +277,9 @@ class StabilityTests(unittest.TestCase):
         self.assertIn("rm", reason)
 
     def test_termux_compact_extracts_error_lines(self) -> None:
-        from lib.analyzer import AIAnalyzer
-
-        a = AIAnalyzer(
-            api_key="x",
-            model="m",
-            base_url="http://example.invalid",
-            tool_specs={},
-            client_override=self._DummyClient(),
-        )
-        stdout = "\n".join([f"noise{i}" for i in range(50)]) + "\nPermission denied: /data\n" + "\n".join(
-            [f"tail{i}" for i in range(50)])
+        a = self._fresh_analyzer()
+        stdout = "\n".join("noise%d" % i for i in range(50)) + "\nPermission denied: /data\n" + "\n".join(
+            "tail%d" % i for i in range(50))
         out = a._compact_tool_result("termux_command", {"stdout": stdout})
         self.assertIn("Permission denied", str(out.get("stdout", "")))
 